@@ -0,0 +1,107 @@
+"""
+Benchmark: HTTP load against a running Product Store
+
+Opens a number of keep-alive connections and sends GET requests on each
+as fast as the server answers, then prints the requests per second and
+the latency percentiles. It is used to compare the serving modes:
+
+    # sync mode (WSGI), see gunicorn.conf.py
+    GUNICORN_WORKERS=2 GUNICORN_THREADS=1 PORT=8000 gunicorn service:app
+    # async mode (ASGI)
+    uvicorn service.asgi:application --workers 2 --port 8001
+
+    python -m benchmarks.http_load --url http://localhost:8000/products/1 -c 256
+    python -m benchmarks.http_load --url http://localhost:8001/products/1 -c 256
+
+Usage: python -m benchmarks.http_load --url URL [-c N] [-d SECONDS]
+"""
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+
+async def exchange(reader, writer, request: bytes) -> bool:
+    """Sends a request and reads the response, returning if the connection stays open"""
+    writer.write(request)
+    await writer.drain()
+    if not (await reader.readline()).startswith(b"HTTP/"):
+        raise ConnectionResetError("no response")
+    length = 0
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "connection" and value == "close":
+            keep_alive = False
+    await reader.readexactly(length)
+    return keep_alive
+
+
+async def worker(host: str, port: int, request: bytes, deadline: float, latencies: list):
+    """Sends requests until the deadline, reconnecting when the server closes"""
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        try:
+            keep_alive = await exchange(reader, writer, request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the server closed the connection, e.g. while recycling a worker
+            writer.close()
+            reader = writer = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns a percentile of sorted values"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(url: str, connections: int, duration: float) -> list:
+    """Runs the load and returns every request latency"""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    request = (
+        f"GET {path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    ).encode("latin-1")
+    latencies = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[
+        worker(parts.hostname, parts.port or 80, request, deadline, latencies)
+        for _ in range(connections)
+    ])
+    return latencies
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True)
+    parser.add_argument("-c", "--connections", type=int, default=64)
+    parser.add_argument("-d", "--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    latencies = sorted(asyncio.run(run(args.url, args.connections, args.duration)))
+    print(f"connections: {args.connections}")
+    print(f"requests:    {len(latencies)}")
+    print(f"req/s:       {len(latencies) / args.duration:10.1f}")
+    print(f"p50:         {percentile(latencies, 0.50) * 1000:10.1f} ms")
+    print(f"p99:         {percentile(latencies, 0.99) * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: serializing a product listing
+
+Compares hydrating ORM objects and calling Product.serialize() on each
+one with Product.serialize_rows(), which builds the same dictionaries
+straight from column tuples.
+
+Usage: python -m benchmarks.list_serialization [--rows N] [--repeat N]
+"""
+import os
+import argparse
+import timeit
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+
+# pylint: disable=wrong-import-position
+from service import app  # noqa: E402
+from service.models import db, Product, Category  # noqa: E402
+
+
+def load_products(count: int):
+    """Bulk loads count Products into an empty table"""
+    db.drop_all()
+    db.create_all()
+    categories = list(Category)
+    items = [
+        {
+            "name": f"Product {i}",
+            "description": f"Description of product number {i}",
+            "price": f"{i % 1000}.99",
+            "available": i % 2 == 0,
+            "category": categories[i % len(categories)].name,
+        }
+        for i in range(count)
+    ]
+    Product.bulk_create(items, chunk_size=5000)
+
+
+def orm_listing():
+    """Serializes every Product through the ORM"""
+    db.session.expunge_all()
+    return [product.serialize() for product in Product.query]
+
+
+def row_listing():
+    """Serializes every Product from column tuples"""
+    return list(Product.serialize_rows(Product.query))
+
+
+def main():
+    """Runs the benchmark and prints the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        load_products(args.rows)
+        assert orm_listing() == row_listing()
+
+        orm = min(timeit.repeat(orm_listing, number=1, repeat=args.repeat))
+        rows = min(timeit.repeat(row_listing, number=1, repeat=args.repeat))
+    print(f"rows:              {args.rows}")
+    print(f"ORM + serialize(): {orm * 1000:8.1f} ms")
+    print(f"serialize_rows():  {rows * 1000:8.1f} ms")
+    print(f"speedup:           {orm / rows:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
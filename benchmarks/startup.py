@@ -0,0 +1,76 @@
+"""
+Benchmark: worker startup time
+
+Measures, in a fresh interpreter like a new gunicorn worker, how long it
+takes to import the service (which creates the app) and to answer the
+first request, and checks both against the startup budget. The schema
+is created beforehand, as 'flask db-init' does once per deployment.
+
+Usage: python -m benchmarks.startup [--database-uri URI] [-n RUNS]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+# Seconds a worker may take to import the service and to answer its first request
+IMPORT_BUDGET = 1.5
+FIRST_REQUEST_BUDGET = 0.25
+
+SETUP = """
+from service import app
+from service.models import db
+with app.app_context():
+    db.create_all()
+"""
+
+MEASURE = """
+import json, time
+start = time.perf_counter()
+from service import app
+imported = time.perf_counter()
+response = app.test_client().get("/products?limit=10")
+done = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import": imported - start, "first_request": done - imported}))
+"""
+
+
+def run(code: str, database_uri: str) -> str:
+    """Runs code in a fresh interpreter and returns what it printed"""
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+    )
+    return result.stdout
+
+
+def measure(database_uri: str, runs: int) -> dict:
+    """Returns the best import and first request times over several runs"""
+    run(SETUP, database_uri)
+    timings = [json.loads(run(MEASURE, database_uri)) for _ in range(runs)]
+    return {key: min(timing[key] for timing in timings) for key in timings[0]}
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-uri")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        uri = args.database_uri or f"sqlite:///{directory}/startup.db"
+        timing = measure(uri, args.runs)
+    print(f"import:        {timing['import'] * 1000:8.1f} ms "
+          f"(budget {IMPORT_BUDGET * 1000:.0f} ms)")
+    print(f"first request: {timing['first_request'] * 1000:8.1f} ms "
+          f"(budget {FIRST_REQUEST_BUDGET * 1000:.0f} ms)")
+    over = timing["import"] > IMPORT_BUDGET or timing["first_request"] > FIRST_REQUEST_BUDGET
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
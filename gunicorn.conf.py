@@ -0,0 +1,71 @@
+"""
+Gunicorn configuration for the Product Store
+
+gunicorn reads this file from the working directory, so the service is
+started with just:
+
+    gunicorn service:app
+
+The app is imported once in the master and shared with the workers
+(preload_app), so a worker starts without importing anything. Every
+worker disposes of the database engine it inherited right after the
+fork, so no two processes share a pooled connection. Workers are
+recycled after a jittered number of requests to bound slow leaks
+without restarting them all at once.
+
+Every setting can be overridden with an environment variable; see
+benchmarks/gunicorn_settings.py for how throughput changes with them.
+"""
+import os
+import multiprocessing
+
+# pylint: disable=invalid-name
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# Import the app once in the master and fork the workers from it
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Two workers per CPU plus one, each with a few threads to overlap
+# database waits; threads switch the worker class to gthread
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Seconds to hold an idle keep-alive connection open for the next request
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Restart a worker after this many requests, plus up to the jitter, so
+# that the workers do not all restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "1000"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(_server, _worker):
+    """Gives the worker its own database connections
+
+    An engine the master created before the fork would hand the same
+    sockets to every worker. close=False leaves the master's connections
+    open for the master and the worker opens new ones on first use.
+    """
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db, replicas
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    replicas.dispose(close=False)
+
+
+def child_exit(_server, worker):
+    """Drops the live gauges of a worker that exited from the shared metrics"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -18,41 +18,65 @@
 Package: service
 
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module contains the create_app() factory that creates and configures
+the Flask app and sets up the logging and SQL database. It does not touch
+the database: the schema is created once per deployment with 'flask db-init'
 """
 import sys
 from flask import Flask
 from service import config
 from service.common import log_handlers
+from service.common.json_encoder import FastJSONEncoder
 
-# NOTE: Do not change the order of this code
-# The Flask app must be created
-# BEFORE you import modules that depend on it !!!
 
-# Create the Flask aoo
-app = Flask(__name__)  # pylint: disable=invalid-name
+def create_app(config_object=config) -> Flask:
+    """Creates and configures a Flask app for the Product Store
 
-# Load Configurations
-app.config.from_object(config)
+    Only one app per process is supported: the database, the caches and
+    the read replicas are shared by the whole process, and each call sets
+    them up again with its own configuration.
 
-# Dependencies require we import the routes AFTER the Flask app is created
-# pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models        # noqa: F401, E402
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+    :param config_object: the object to load the configuration from
+    :type config_object: object
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    :return: the Flask app
+    :rtype: Flask
 
-app.logger.info(70 * "*")
-app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    """
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service import routes, models
+    from service.common import (
+        error_handlers, cli_commands, compression, metrics, replicas, sql_timing
+    )
 
-try:
-    models.init_db(app)  # make our sqlalchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    # Create the Flask app
+    flask_app = Flask(__name__)
 
-app.logger.info("Service initialized!")
+    # Load Configurations
+    flask_app.config.from_object(config_object)
+    flask_app.json_encoder = FastJSONEncoder
+
+    flask_app.register_blueprint(routes.bp)
+    for module in (error_handlers, cli_commands, compression, metrics, replicas, sql_timing):
+        flask_app.register_blueprint(module.bp)
+
+    # Set up logging for production
+    log_handlers.init_logging(flask_app, "gunicorn.error")
+
+    flask_app.logger.info(70 * "*")
+    flask_app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    flask_app.logger.info(70 * "*")
+
+    try:
+        models.init_db(flask_app)
+    except Exception as error:  # pylint: disable=broad-except
+        flask_app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    flask_app.logger.info("Service initialized!")
+    return flask_app
+
+
+# The app that 'flask', gunicorn (service:app) and the tests use
+app = create_app()  # pylint: disable=invalid-name
@@ -0,0 +1,248 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+ASGI Serving Mode
+
+This module serves the Product Store on an ASGI server. The read-heavy
+endpoints GET /products and GET /products/{id} are answered by coroutines
+that query through an async SQLAlchemy engine, so a request waiting on the
+database does not hold a worker. Every other request, and the listing
+options the coroutines do not handle (paging, streaming, fields), is passed on
+unchanged to the Flask app, so the URLs and JSON contracts are the same
+in both modes.
+
+The coroutines record the same request metrics and Server-Timing header
+as the Flask app, under the same route labels.
+
+Usage: uvicorn service.asgi:application --workers 4
+
+Requires asgiref and an async driver for the database (asyncpg for
+PostgreSQL, aiosqlite for SQLite).
+"""
+import re
+import time
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import NotFound
+from werkzeug.http import generate_etag, parse_cookie, parse_etags, quote_etag
+from service import app
+from service.models import Product, DataValidationError, db, product_cache
+from service.common import status
+from service.common.compression import choose_encoding, compress_body
+from service.common.metrics import IN_FLIGHT, observe
+from service.common.replicas import STICKY_COOKIE
+from service.common.sql_timing import RequestTiming, asgi_timing
+
+PRODUCT_PATH = re.compile(r"^/products/(\d+)$")
+# Route labels of the metrics, the URL rules of the Flask routes
+PRODUCT_ROUTE = "/products/<int:product_id>"
+PRODUCTS_ROUTE = "/products"
+FILTERS = {"category", "name", "available", "min_price", "max_price"}
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the URI of the async driver for a database URI"""
+    if uri.startswith("postgresql://") or uri.startswith("postgres://"):
+        return "postgresql+asyncpg://" + uri.split("://", 1)[1]
+    if uri.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + uri.split("://", 1)[1]
+    return uri
+
+
+class AsyncProductApp:
+    """An ASGI app that serves product reads asynchronously"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        self.engine = None
+
+    def get_engine(self):
+        """Returns the async engine, creating it in the serving process"""
+        if self.engine is None:
+            config = self.flask_app.config
+            # use the sync engine's URL, which has SQLite paths made absolute
+            uri = config.get("ASYNC_DATABASE_URI") or async_database_uri(
+                db.get_engine(self.flask_app).url.render_as_string(hide_password=False)
+            )
+            options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+            options.pop("poolclass", None)  # async engines need an async pool
+            self.engine = create_async_engine(uri, **options)
+        return self.engine
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET":
+            headers = {key.decode("latin-1"): value.decode("latin-1")
+                       for key, value in scope["headers"]}
+            match = PRODUCT_PATH.match(scope["path"])
+            # a client that just wrote goes to Flask, which reads past the cache
+            sticky = STICKY_COOKIE in parse_cookie(headers.get("cookie", ""))
+            if match and not scope["query_string"] and not sticky:
+                product_id = int(match.group(1))
+                await self.serve(
+                    scope, PRODUCT_ROUTE, send,
+                    lambda send: self.get_product(product_id, headers, send),
+                )
+                return
+            args = parse_qsl(scope["query_string"].decode("latin-1"))
+            if scope["path"] == "/products" and self.can_list(args, headers):
+                await self.serve(
+                    scope, PRODUCTS_ROUTE, send,
+                    lambda send: self.list_products(dict(args), headers, send),
+                )
+                return
+        await self.fallback(scope, receive, send)
+
+    async def serve(self, scope, route: str, send, handler):
+        """Runs a coroutine handler with the metrics and SQL timing of the Flask app
+
+        The handler is called with a send that adds the Server-Timing header
+        of the statements it ran to the response.
+        """
+        method = scope["method"]
+        timing = RequestTiming()
+        token = asgi_timing.set(timing)
+        codes = []
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                codes.append(message["status"])
+                header = timing.server_timing().encode("latin-1")
+                message = dict(message, headers=[*message["headers"], (b"server-timing", header)])
+            await send(message)
+
+        start = time.perf_counter()
+        IN_FLIGHT.labels(route, method).inc()
+        try:
+            await handler(send_with_timing)
+        finally:
+            IN_FLIGHT.labels(route, method).dec()
+            asgi_timing.reset(token)
+            code = codes[0] if codes else status.HTTP_500_INTERNAL_SERVER_ERROR
+            observe(route, method, code, time.perf_counter() - start)
+        timing.log_repeats(method, scope["path"], self.flask_app.config["SQL_REPEAT_THRESHOLD"])
+
+    async def lifespan(self, receive, send):
+        """Disposes of the async engine when the server shuts down"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    def can_list(args: list, headers: dict) -> bool:
+        """Checks if a listing only uses options the async path supports"""
+        if "application/x-ndjson" in headers.get("accept", ""):
+            return False
+        return all(key in FILTERS for key, _ in args)
+
+    async def get_product(self, product_id: int, headers: dict, send):
+        """Returns a product like routes.get_product does"""
+        entry = product_cache.get(product_id)
+        if entry is None:
+            statement = select(*Product.serialized_columns(), Product.version).where(
+                Product.id == product_id
+            )
+            async with self.get_engine().connect() as connection:
+                row = (await connection.execute(statement)).first()
+            if row is None:
+                message = str(NotFound(f"Product with id {product_id} not found"))
+                await self.send_error(send, status.HTTP_404_NOT_FOUND, "Not Found", message)
+                return
+            data = Product.serialize_row(row)
+            entry = (data, Product.version_etag(row[-1]))
+            product_cache.set(product_id, entry)
+        data, etag = entry
+        await self.send_json(send, data, etag, headers)
+
+    async def list_products(self, args: dict, headers: dict, send):
+        """Returns the filtered products like routes.list_products does"""
+        available = args.get("available")
+        try:
+            criteria = Product.filter_criteria(
+                category=args.get("category") or None,
+                name=args.get("name") or None,
+                available=available == "true" if available else None,
+                min_price=args.get("min_price") or None,
+                max_price=args.get("max_price") or None,
+            )
+        except DataValidationError as error:
+            await self.send_error(send, status.HTTP_400_BAD_REQUEST, "Bad Request", str(error))
+            return
+        statement = select(*Product.serialized_columns()).where(*criteria)
+        async with self.get_engine().connect() as connection:
+            rows = (await connection.execute(statement)).all()
+        await self.send_json(send, [Product.serialize_row(row) for row in rows], None, headers)
+
+    async def send_json(self, send, data, etag, headers: dict):
+        """Sends data encoded by the Flask app, or a 304 if it is unchanged
+
+        Bodies are compressed like compression.compress_response does.
+        """
+        with self.flask_app.app_context():
+            body = jsonify(data).get_data()
+        if etag is None:
+            etag = generate_etag(body)
+        if parse_etags(headers.get("if-none-match")).contains_weak(etag):
+            await self.send_response(send, status.HTTP_304_NOT_MODIFIED, b"", etag=etag)
+            return
+        encoding = choose_encoding(headers.get("accept-encoding"))
+        if encoding is None or len(body) < self.flask_app.config["COMPRESS_MIN_SIZE"]:
+            await self.send_response(send, status.HTTP_200_OK, body, etag=etag)
+            return
+        body = compress_body(body, encoding, self.flask_app.config)
+        await self.send_response(
+            send, status.HTTP_200_OK, body, etag=quote_etag(etag, weak=True), encoding=encoding
+        )
+
+    async def send_error(self, send, code: int, error: str, message: str):
+        """Sends an error body like the handlers in error_handlers do"""
+        with self.flask_app.app_context():
+            body = jsonify(status=code, error=error, message=message).get_data()
+        await self.send_response(send, code, body)
+
+    @staticmethod
+    async def send_response(send, code: int, body: bytes, etag: str = None, encoding: str = None):
+        """Sends a complete response
+
+        A weak etag is passed already quoted, as in W/"...".
+        """
+        headers = [(b"content-type", b"application/json"), (b"vary", b"Accept-Encoding")]
+        if code != status.HTTP_304_NOT_MODIFIED:
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        if etag is not None:
+            if not etag.startswith("W/"):
+                etag = quote_etag(etag)
+            headers.append((b"etag", etag.encode("latin-1")))
+        await send({"type": "http.response.start", "status": code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+application = AsyncProductApp(app)  # pylint: disable=invalid-name
@@ -1,15 +1,20 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+from flask import Blueprint, current_app
+from sqlalchemy import text
+from sqlalchemy.schema import CreateColumn
+from service.models import db, Product
+
+# Commands are added to the top level of the flask command
+bp = Blueprint("cli_commands", __name__, cli_group=None)  # pylint: disable=invalid-name
 
 
 ######################################################################
 # Command to force tables to be rebuilt
 # Usage: flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@bp.cli.command("db-create")
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -18,3 +23,43 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create indexes missing from an existing table
+# Usage: flask db-indexes
+######################################################################
+@bp.cli.command("db-indexes")
+def db_indexes():
+    """
+    Creates the Product indexes that the database does not have yet
+    """
+    create_indexes()
+
+
+######################################################################
+# Command to create the schema once per deployment
+# Usage: flask db-init
+######################################################################
+@bp.cli.command("db-init")
+def db_init():
+    """
+    Creates the tables and indexes that do not exist yet, keeping the
+    data. Run it once per deployment, before the workers start.
+    """
+    db.create_all()
+    for column in Product.missing_columns():
+        current_app.logger.info("Adding column %s", column.name)
+        ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {Product.__tablename__} ADD COLUMN {ddl}"))
+    create_indexes()
+
+
+def create_indexes():
+    """Creates the missing Product indexes and the search index"""
+    for index in Product.missing_indexes():
+        current_app.logger.info("Creating index %s", index.name)
+        index.create(db.engine)
+    with db.engine.begin() as connection:
+        Product.create_search_index(connection)
@@ -0,0 +1,192 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Compression
+
+This module compresses responses with the best encoding the client
+accepts. gzip is always available, brotli and zstd are used when the
+brotli and zstandard packages are installed. Buffered bodies smaller than
+COMPRESS_MIN_SIZE are sent as they are, and streamed bodies are
+compressed chunk by chunk as they are written out.
+"""
+import zlib
+from flask import Blueprint, current_app, request
+from werkzeug.http import parse_accept_header, quote_etag
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+bp = Blueprint("compression", __name__)  # pylint: disable=invalid-name
+
+# Mimetypes worth compressing
+COMPRESSIBLE = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+}
+
+
+class GzipCompressor:
+    """Writes a gzip stream"""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data, returning whatever output is ready"""
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns all the output so far so the client can decode it"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    """Writes a brotli stream"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data, returning whatever output is ready"""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Returns all the output so far so the client can decode it"""
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    """Writes a zstd stream"""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data, returning whatever output is ready"""
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns all the output so far so the client can decode it"""
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """Ends the stream"""
+        return self._compressor.flush()
+
+
+def available_encodings() -> dict:
+    """Returns the compressor and config key of each usable encoding, best first"""
+    encodings = {}
+    if brotli is not None:
+        encodings["br"] = (BrotliCompressor, "COMPRESS_BR_LEVEL")
+    if zstandard is not None:
+        encodings["zstd"] = (ZstdCompressor, "COMPRESS_ZSTD_LEVEL")
+    encodings["gzip"] = (GzipCompressor, "COMPRESS_LEVEL")
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Returns the best encoding the client accepts, or None for identity"""
+    accepted = parse_accept_header(accept_encoding or "")
+    return accepted.best_match(list(available_encodings()))
+
+
+def make_compressor(encoding: str, config: dict):
+    """Returns a compressor for an encoding at the configured level"""
+    compressor_class, level_key = available_encodings()[encoding]
+    return compressor_class(config[level_key])
+
+
+def compress_body(body: bytes, encoding: str, config: dict) -> bytes:
+    """Compresses a whole body"""
+    compressor = make_compressor(encoding, config)
+    return compressor.compress(body) + compressor.finish()
+
+
+def compress_stream(chunks, compressor):
+    """Compresses an iterable of chunks, flushing after each one
+
+    Every chunk the application yields is sent to the client as soon as it
+    is compressed, so a streamed listing still arrives incrementally.
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush()
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def weaken_etag(response):
+    """Marks a strong ETag as weak since the bytes now depend on the encoding"""
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.headers["ETag"] = quote_etag(etag, weak=True)
+
+
+@bp.after_app_request
+def compress_response(response):
+    """Compresses a response if it is large enough and the client accepts it"""
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    config = current_app.config
+    if response.is_streamed:
+        compressor = make_compressor(encoding, config)
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compress_body(body, encoding, config))
+    response.headers["Content-Encoding"] = encoding
+    weaken_etag(response)
+    return response
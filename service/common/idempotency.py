@@ -0,0 +1,125 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+
+"""
+Idempotency
+
+This module lets clients retry a POST safely. A request with an
+Idempotency-Key header claims the key in the idempotency_key table before
+it runs, and its response (status and body) is stored under the key for
+IDEMPOTENCY_TTL seconds. A retry with the same key is answered from the
+table without running the view again, and a duplicate that arrives while
+the first request is still running waits for its response. The table is
+shared by every worker, and expired rows are purged as requests come in.
+"""
+import time
+import hashlib
+from functools import wraps
+from flask import Response, abort, current_app, request
+from service.models import IdempotencyKey
+from service.common.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_409_CONFLICT,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+    HTTP_500_INTERNAL_SERVER_ERROR,
+)
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Seconds between polls of a key whose first request is still running
+POLL_INTERVAL = 0.05
+
+# Seconds between purges of the expired rows, per process
+PURGE_INTERVAL = 60.0
+_last_purge = [0.0]
+
+
+def fingerprint() -> str:
+    """Returns a digest of the method, path and body of the request"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(record) -> Response:
+    """Returns the stored response of the first request with the key"""
+    response = current_app.response_class(
+        record.body, status=record.status, mimetype="application/json"
+    )
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def purge_expired():
+    """Deletes the expired keys at most once every PURGE_INTERVAL seconds"""
+    now = time.monotonic()
+    if now - _last_purge[0] >= PURGE_INTERVAL:
+        _last_purge[0] = now
+        IdempotencyKey.purge()
+
+
+def idempotent(view):
+    """Makes a view answer retries with the same Idempotency-Key from the table
+
+    Only responses the view returns below 500 are stored. If the view
+    raises or fails with a server error the claim is released, so that
+    a retry runs the request again.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            abort(HTTP_400_BAD_REQUEST, f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters")
+
+        config = current_app.config
+        purge_expired()
+        digest = fingerprint()
+        deadline = time.monotonic() + config["IDEMPOTENCY_WAIT"]
+        while True:
+            record = IdempotencyKey.claim(key, digest, config["IDEMPOTENCY_LEASE"])
+            if record is None:
+                break
+            if record.fingerprint != digest:
+                abort(HTTP_422_UNPROCESSABLE_ENTITY, f"{HEADER} was used for a different request")
+            if record.status is not None:
+                return replay(record)
+            if time.monotonic() >= deadline:
+                abort(HTTP_409_CONFLICT, f"A request with this {HEADER} is still in progress")
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            IdempotencyKey.release(key)
+            raise
+        if response.status_code >= HTTP_500_INTERNAL_SERVER_ERROR or response.is_streamed:
+            IdempotencyKey.release(key)
+        else:
+            IdempotencyKey.complete(
+                key,
+                response.status_code,
+                response.get_data(as_text=True),
+                config["IDEMPOTENCY_TTL"],
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,93 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+JSON Encoder
+
+This module contains the JSON encoder of the Flask app. It encodes with
+orjson when that package is installed and writes the same bytes as the
+standard library encoder; anything orjson would write differently is
+passed on to the standard library encoder.
+"""
+from enum import Enum
+from itertools import chain
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Values that orjson would encode differently are handed to default()
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+)
+
+SCALARS = frozenset({str, int, float, bool, type(None)})
+
+
+def contains_enum(data) -> bool:
+    """Returns True if there is an Enum anywhere in data
+
+    orjson writes Enums by value without calling default(), so payloads
+    with Enums go to the standard library encoder instead. A list of
+    objects, the usual payload, is checked with all their values at once.
+    """
+    if isinstance(data, dict):
+        values = list(data.values())
+    elif isinstance(data, (list, tuple)):
+        values = data
+    else:
+        return isinstance(data, Enum)
+    types = set(map(type, values))
+    if types <= SCALARS:
+        return False
+    if types == {dict}:
+        return contains_enum(list(chain.from_iterable(map(dict.values, values))))
+    return any(contains_enum(value) for value in values if type(value) not in SCALARS)
+
+
+class FastJSONEncoder(JSONEncoder):
+    """A JSONEncoder that encodes compact JSON with orjson
+
+    orjson is used for the compact separators that jsonify() writes. It
+    is skipped for indented output, for output with non-ASCII characters
+    when ensure_ascii is set (orjson writes them as UTF-8 rather than as
+    escapes), for values it cannot encode, such as integer dict keys, and
+    for values with Enums. Decimals are written as strings like Flask
+    does, and Enums by their name, like the category of a Product. The
+    only floats written differently are those with exponents (1e20 rather
+    than 1e+20) and NaN and Infinity, which orjson writes as null; no
+    Product field is a float.
+    """
+
+    def default(self, o):
+        if isinstance(o, Enum):
+            return o.name
+        return super().default(o)
+
+    def encode(self, o) -> str:
+        compact = self.indent is None and (self.item_separator, self.key_separator) == (",", ":")
+        if orjson is None or not compact or contains_enum(o):
+            return super().encode(o)
+        option = ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            data = orjson.dumps(o, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().encode(o)
+        if self.ensure_ascii and not data.isascii():
+            return super().encode(o)
+        return data.decode("utf-8")
@@ -0,0 +1,119 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Metrics
+
+This module records the count, status codes, latency and in-flight number
+of the requests to every route and renders them in the Prometheus text
+format.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory that
+all the workers share: every worker then writes its values to files in
+it and a scrape of any worker adds up the values of all of them.
+"""
+import os
+import time
+from flask import Blueprint, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+bp = Blueprint("metrics", __name__)  # pylint: disable=invalid-name
+
+# Route label of requests that match no route, so that unknown URLs
+# cannot create new series
+UNMATCHED = "<unmatched>"
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by route, method and status code",
+    ["route", "method", "status"],
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route and method",
+    ["route", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests being served by route and method",
+    ["route", "method"],
+    multiprocess_mode="livesum",
+)
+
+
+def route_label() -> str:
+    """Returns the URL rule of the request, such as /products/<int:product_id>"""
+    return request.url_rule.rule if request.url_rule else UNMATCHED
+
+
+@bp.before_app_request
+def start_request_metrics():
+    """Starts the clock and counts the request as in flight"""
+    g.metrics_start = time.perf_counter()
+    g.metrics_labels = (route_label(), request.method)
+    IN_FLIGHT.labels(*g.metrics_labels).inc()
+
+
+def observe(route: str, method: str, status: int, seconds: float):
+    """Records the latency and the status code of a request"""
+    LATENCY.labels(route, method).observe(seconds)
+    REQUESTS.labels(route, method, str(status)).inc()
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    """Records the latency and the status code of the request"""
+    if "metrics_labels" in g:
+        route, method = g.metrics_labels
+        observe(route, method, response.status_code, time.perf_counter() - g.metrics_start)
+    return response
+
+
+@bp.teardown_app_request
+def end_request_metrics(_error=None):
+    """Counts the request as done, even if it failed"""
+    labels = g.pop("metrics_labels", None)
+    if labels is not None:
+        IN_FLIGHT.labels(*labels).dec()
+
+
+def render() -> tuple:
+    """Returns the metrics of every worker in the text format and its content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Removes the in-flight values of a worker that exited
+
+    Call it from the gunicorn child_exit hook.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
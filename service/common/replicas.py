@@ -0,0 +1,252 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Replicas
+
+This module routes the SELECT statements of read-only requests to read
+replicas. The replicas take turns, and one that fails a statement or a
+health check is left out until a later health check succeeds. Everything
+else goes to the primary: writes, statements of a session that has
+written in its transaction, and every request of a client that wrote
+within the last REPLICA_STICKY_SECONDS, so clients read their own writes.
+The health checks run in a background thread, so a replica that does not
+answer never holds up a request.
+"""
+import time
+import logging
+import threading
+from flask import Blueprint, current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger("flask.app")
+
+bp = Blueprint("replicas", __name__)  # pylint: disable=invalid-name
+
+# Cookie that keeps a client on the primary for a while after it writes
+STICKY_COOKIE = "read_primary"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# The connect argument that bounds how long a driver waits for a server,
+# by dialect; SQLite opens a file and needs none
+CONNECT_TIMEOUT_ARGS = {"postgresql": "connect_timeout", "mysql": "connect_timeout"}
+
+
+class ReplicaSet:
+    """The read replicas of the database and their health"""
+
+    def __init__(self, check_interval: float = 10.0, timer=time.monotonic):
+        self.check_interval = check_interval
+        self.timer = timer
+        self.engines = []
+        self.healthy = set()
+        self.checked_at = None
+        self.check_thread = None
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def configure(
+        self, uris: list, engine_options: dict = None, check_interval: float = 10.0,
+        connect_timeout: int = 2
+    ):
+        """Replaces the replicas with engines for the given URIs
+
+        The engines connect on first use, so this does not touch the
+        replicas. Every replica starts out healthy.
+        """
+        self.dispose()
+        options = dict(engine_options or {})
+        options.pop("poolclass", None)
+        engines = [create_engine(uri, **self._with_timeout(uri, options, connect_timeout))
+                   for uri in uris]
+        for engine in engines:
+            event.listen(engine, "handle_error", self._on_error(engine))
+        with self._lock:
+            self.engines = engines
+            self.healthy = set(range(len(engines)))
+            self.check_interval = check_interval
+            self.checked_at = self.timer()
+
+    @staticmethod
+    def _with_timeout(uri: str, options: dict, connect_timeout: int) -> dict:
+        """Returns the engine options with a connect timeout for the driver"""
+        argument = CONNECT_TIMEOUT_ARGS.get(make_url(uri).get_backend_name())
+        if argument is None:
+            return options
+        connect_args = dict(options.get("connect_args", {}))
+        connect_args.setdefault(argument, connect_timeout)
+        return dict(options, connect_args=connect_args)
+
+    def dispose(self, close: bool = True):
+        """Closes the pooled connections of every replica"""
+        for engine in self.engines:
+            engine.dispose(close=close)
+
+    def choose(self):
+        """Returns the next healthy replica engine, or None to use the primary
+
+        Once the check interval has passed, the first caller starts a health
+        check in the background and every caller carries on without it.
+        """
+        if not self.engines:
+            return None
+        with self._lock:
+            due = self.timer() - self.checked_at >= self.check_interval
+            if due and self.check_thread is None:
+                self.checked_at = self.timer()
+                self.check_thread = threading.Thread(
+                    target=self._check_in_background, name="replica-health-check", daemon=True
+                )
+                self.check_thread.start()
+            for _ in range(len(self.engines)):
+                index = self._next % len(self.engines)
+                self._next += 1
+                if index in self.healthy:
+                    return self.engines[index]
+        return None
+
+    def _check_in_background(self):
+        try:
+            self.check()
+        finally:
+            with self._lock:
+                self.check_thread = None
+
+    def check(self):
+        """Runs a health check on every replica"""
+        with self._lock:
+            self.checked_at = self.timer()
+        for index, engine in enumerate(self.engines):
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except Exception as error:  # pylint: disable=broad-except
+                if index in self.healthy:
+                    logger.warning("Replica %s failed its health check: %s", engine.url, error)
+                self.mark_down(engine)
+            else:
+                with self._lock:
+                    if index not in self.healthy:
+                        logger.info("Replica %s is back in rotation", engine.url)
+                    self.healthy.add(index)
+
+    def mark_down(self, engine):
+        """Takes a replica out of rotation until it passes a health check"""
+        with self._lock:
+            if engine in self.engines:
+                self.healthy.discard(self.engines.index(engine))
+
+    def _on_error(self, engine):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+                logger.warning("Replica %s failed a statement, taking it out", engine.url)
+                self.mark_down(engine)
+        return handle_error
+
+    def stats(self) -> dict:
+        """Returns the replicas and whether each is in rotation"""
+        with self._lock:
+            return {
+                "replicas": [
+                    {"url": engine.url.render_as_string(hide_password=True),
+                     "healthy": index in self.healthy}
+                    for index, engine in enumerate(self.engines)
+                ],
+            }
+
+
+replicas = ReplicaSet()
+
+
+@bp.before_app_request
+def choose_replica():
+    """Lets the SELECTs of a read-only request go to a replica"""
+    read_only = request.method in SAFE_METHODS and STICKY_COOKIE not in request.cookies
+    g.replica_engine = replicas.choose() if read_only else None
+
+
+def reading_replica() -> bool:
+    """Returns True if the SELECTs of the current request go to a replica
+
+    What a replica returns may lag behind the primary, so it must not be
+    put in a cache that other requests read.
+    """
+    return has_request_context() and g.get("replica_engine") is not None
+
+
+def reading_own_writes() -> bool:
+    """Returns True if the client of the current request wrote recently
+
+    Such a client must read from the primary, so it skips the caches too:
+    another request may have filled them before its write was visible.
+    """
+    return has_request_context() and STICKY_COOKIE in request.cookies
+
+
+@bp.after_app_request
+def stick_to_primary(response):
+    """Keeps a client that wrote on the primary so that it reads its writes"""
+    if replicas.engines and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            STICKY_COOKIE, "1", max_age=current_app.config["REPLICA_STICKY_SECONDS"], httponly=True
+        )
+    return response
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends the SELECTs of read-only requests to a replica
+
+    A request is read-only when before_request put a replica engine in
+    g.replica_engine. A session that has flushed or has pending changes
+    reads from the primary until its transaction ends.
+    """
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        event.listen(self, "after_flush", self._on_write)
+        event.listen(self, "after_transaction_end", self._on_transaction_end)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if clause is not None and not isinstance(clause, Select):
+            # an UPDATE, DELETE or raw statement may write without a flush
+            self.info["wrote"] = True
+        elif (
+            clause is not None
+            and has_request_context()
+            and g.get("replica_engine") is not None
+            and not self.info.get("wrote")
+            and not (self.new or self.dirty or self.deleted)
+        ):
+            return g.replica_engine
+        return super().get_bind(mapper, clause)
+
+    def _on_write(self, _session, _flush_context):
+        self.info["wrote"] = True
+
+    def _on_transaction_end(self, _session, transaction):
+        if transaction.parent is None:
+            self.info.pop("wrote", None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with a RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
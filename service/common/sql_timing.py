@@ -0,0 +1,153 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+SQL Timing
+
+This module times every statement sent to the database. The number of
+statements and the time spent in the database during a request are sent
+back in a Server-Timing header, statements slower than SQL_SLOW_QUERY_MS
+are logged with their literals and parameters redacted, and a request that
+runs the same statement SQL_REPEAT_THRESHOLD times or more is logged as a
+likely N+1 query.
+"""
+import re
+import time
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from flask import Blueprint, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service import config
+
+logger = logging.getLogger("flask.app")
+
+bp = Blueprint("sql_timing", __name__)  # pylint: disable=invalid-name
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = r"\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*"
+PLACEHOLDER_LISTS = re.compile(rf"\((?:{PLACEHOLDER},)+{PLACEHOLDER}\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Returns a statement with its literals and placeholder lists collapsed
+
+    Statements that differ only in their values, or in how many values an
+    IN list holds, have the same shape.
+    """
+    shape = LITERALS.sub("?", statement)
+    shape = PLACEHOLDER_LISTS.sub("(?)", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+
+def redact_parameters(parameters) -> str:
+    """Describes the parameters of a statement without their values"""
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(
+        parameters[0], (list, tuple, dict)
+    ):
+        return f"[{len(parameters)} parameter sets redacted]"
+    count = len(parameters) if parameters else 0
+    return f"[{count} parameters redacted]"
+
+
+class RequestTiming:
+    """The statements of one request and the time spent running them"""
+
+    def __init__(self):
+        self.time = 0.0
+        self.statements = Counter()
+
+    def add(self, statement: str, elapsed: float):
+        """Counts a statement that took elapsed seconds"""
+        self.time += elapsed
+        self.statements[statement_shape(statement)] += 1
+
+    def server_timing(self) -> str:
+        """Returns the value of the Server-Timing header"""
+        count = sum(self.statements.values())
+        return f'db;dur={self.time * 1000:.2f};desc="{count} queries"'
+
+    def log_repeats(self, method: str, path: str, threshold: int):
+        """Warns about the statements that ran threshold times or more"""
+        for shape, repeats in self.statements.items():
+            if repeats >= threshold:
+                logger.warning(
+                    "Possible N+1 query: %s %s ran %d times: %s", method, path, repeats, shape
+                )
+
+
+# Timing of the ASGI request being served, which has no Flask g
+asgi_timing = ContextVar("asgi_timing", default=None)
+
+
+def current_timing():
+    """Returns the RequestTiming of the request being served, if any"""
+    if has_request_context():
+        return g.get("sql_timing")
+    return asgi_timing.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, _cursor, _statement, _parameters, _context, _executemany):
+    """Starts the clock for a statement"""
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, _cursor, statement, parameters, _context, _executemany):
+    """Adds a statement to the request totals and logs it if it was slow"""
+    elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+    # statements of the ASGI mode run outside of an app context
+    slow_query_ms = (
+        current_app.config["SQL_SLOW_QUERY_MS"] if has_app_context() else config.SQL_SLOW_QUERY_MS
+    )
+    if elapsed * 1000 >= slow_query_ms:
+        logger.warning(
+            "Slow query (%.1f ms): %s %s",
+            elapsed * 1000, statement_shape(statement), redact_parameters(parameters),
+        )
+    timing = current_timing()
+    if timing is not None:
+        timing.add(statement, elapsed)
+
+
+@bp.before_app_request
+def start_sql_timing():
+    """Starts counting the statements of a request"""
+    g.sql_timing = RequestTiming()
+
+
+@bp.after_app_request
+def send_sql_timing(response):
+    """Adds the Server-Timing header and warns about repeated statements
+
+    A streamed response runs its statements after this hook, when its
+    headers are already fixed, so it gets no header and its statements
+    are checked for repeats once it has been sent.
+    """
+    timing = g.get("sql_timing")
+    if timing is None:
+        return response
+    method, path = request.method, request.path
+    threshold = current_app.config["SQL_REPEAT_THRESHOLD"]
+    if response.is_streamed:
+        response.call_on_close(lambda: timing.log_repeats(method, path, threshold))
+        return response
+    response.headers.add("Server-Timing", timing.server_timing())
+    timing.log_repeats(method, path, threshold)
+    return response
@@ -0,0 +1,101 @@
+######################################################################
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Suggest
+
+This module contains an in-memory index of names that answers
+case-insensitive prefix lookups with a binary search
+"""
+import time
+import bisect
+import threading
+from collections import Counter
+
+
+class PrefixIndex:
+    """A sorted array of names for type-ahead suggestions
+
+    Names are kept sorted by their case-folded form, so all the names that
+    start with a prefix are next to each other and are found with one
+    binary search. A name that several items share is stored once and
+    counted, so removing one of them keeps the name.
+    """
+
+    def __init__(self, max_age: float = 300.0, timer=time.monotonic):
+        self.max_age = max_age
+        self.timer = timer
+        self.built_at = None
+        self._keys = []
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def rebuild(self, names):
+        """Replaces the contents of the index with the given names"""
+        counts = Counter(name for name in names if name)
+        keys = sorted((name.casefold(), name) for name in counts)
+        with self._lock:
+            self._counts = counts
+            self._keys = keys
+            self.built_at = self.timer()
+
+    def invalidate(self):
+        """Marks the index as stale so that it is rebuilt before the next lookup"""
+        with self._lock:
+            self.built_at = None
+
+    def is_stale(self) -> bool:
+        """Checks if the index was never built or is older than max_age"""
+        return self.built_at is None or self.timer() - self.built_at >= self.max_age
+
+    def add(self, name: str):
+        """Adds one occurrence of a name"""
+        if not name:
+            return
+        with self._lock:
+            self._counts[name] += 1
+            if self._counts[name] == 1:
+                bisect.insort(self._keys, (name.casefold(), name))
+
+    def remove(self, name: str):
+        """Removes one occurrence of a name"""
+        with self._lock:
+            if self._counts.get(name, 0) <= 0:
+                return
+            self._counts[name] -= 1
+            if self._counts[name] == 0:
+                del self._counts[name]
+                key = (name.casefold(), name)
+                position = bisect.bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """Returns up to limit names starting with prefix, in alphabetical order"""
+        prefix = prefix.casefold()
+        results = []
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, name = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                results.append(name)
+                position += 1
+        return results
+
+    def __len__(self):
+        return len(self._keys)
@@ -13,7 +13,76 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool for each worker process. SQLite uses a static or null
+# pool that has no size, so only pre-ping and recycle apply to it.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+}
+if not DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    )
+
+# Read replicas for the SELECTs of read-only requests, comma separated.
+# A client that writes reads from the primary for REPLICA_STICKY_SECONDS,
+# and replicas are health checked every REPLICA_CHECK_INTERVAL seconds in
+# the background, giving up on a connection after REPLICA_CONNECT_TIMEOUT
+DATABASE_REPLICA_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()
+]
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "10"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+# Database for the async serving mode (service.asgi), derived from
+# DATABASE_URI with an async driver when not set
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+
+# Keyset pagination for GET /products
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming GET /products
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Products inserted per transaction by POST /products/bulk
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Read-through cache for GET /products/{id}; entries are invalidated on
+# writes in this process and expire after the TTL (seconds) everywhere else
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+
+# Seconds that GET /products/stats results may be served from the cache
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))
+
+# Seconds before the type-ahead name index is reloaded from the database
+SUGGEST_MAX_AGE = float(os.getenv("SUGGEST_MAX_AGE", "300"))
+
+# Statements slower than this (milliseconds) are logged, and a statement
+# repeated this many times in one request is logged as a likely N+1 query
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+
+# Responses to clients sending Accept-Encoding are compressed with brotli,
+# zstd (when those packages are installed) or gzip once the body reaches
+# COMPRESS_MIN_SIZE bytes; streamed listings are always compressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BR_LEVEL = int(os.getenv("COMPRESS_BR_LEVEL", "4"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+
+# Responses to POST /products with an Idempotency-Key are kept for
+# IDEMPOTENCY_TTL seconds. A duplicate waits up to IDEMPOTENCY_WAIT seconds
+# for the first request, whose claim on the key lapses after
+# IDEMPOTENCY_LEASE seconds if it never answers
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "10"))
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "60"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
@@ -28,16 +28,66 @@ description (string) - the description the product belongs to (i.e., dog, cat)
 available (boolean) - True for products that are available for adoption
 
 """
+import json
+import base64
+import binascii
+import re
 import logging
+from datetime import datetime, timedelta
 from enum import Enum
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    and_, case, event, false, func, inspect, literal_column, or_, select, table, column, text
+)
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.sql import Update
+from service.common.cache import LRUCache
+from service.common.pool import TimedQueuePool
+from service.common.replicas import (
+    RoutingSQLAlchemy, reading_own_writes, reading_replica, replicas
+)
+from service.common.suggest import PrefixIndex
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Create the SQLAlchemy object to be initialized later in init_db(). Its
+# sessions send the reads of read-only requests to the replicas, if any
+db = RoutingSQLAlchemy()
+
+# Full-text search index over name and description for each dialect. SQLite
+# uses an FTS5 table kept in sync by triggers, PostgreSQL a GIN index on
+# the same tsvector expression that Product.search() queries.
+SEARCH_DOCUMENT = "to_tsvector('english', name || ' ' || description)"
+SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+        "name, description, content='product', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN "
+        "INSERT INTO product_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE ON product BEGIN "
+        "INSERT INTO product_fts(product_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO product_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+    ],
+    "postgresql": [
+        f"CREATE INDEX IF NOT EXISTS ix_product_search ON product USING GIN ({SEARCH_DOCUMENT})",
+    ],
+}
+
+# Serialized Products by id, sized from the app config in init_db()
+product_cache = LRUCache()
+
+# Catalog statistics by filter, cleared whenever a Product is written
+stats_cache = LRUCache(maxsize=64)
+
+# Product names for type-ahead suggestions, built in init_db()
+product_names = PrefixIndex()
 
 
 def init_db(app):
@@ -71,6 +121,22 @@ class Product(db.Model):
     ##################################################
     # Table Schema
     ##################################################
+    __table_args__ = (
+        # one index per query shape issued by find_by_* and find_by_filters
+        db.Index("ix_product_name", "name"),
+        # (category, available) filters, with price and id so that a sort by
+        # price within them ("10 cheapest available TOOLS") reads the index
+        # in order and stops after N rows
+        db.Index(
+            "ix_product_category_available_price", "category", "available", "price", "id"
+        ),
+        db.Index("ix_product_available", "available"),
+        db.Index("ix_product_price", "price"),
+        # never reuse the id of a deleted product, whose "v1" ETag a client
+        # may still hold for the new one
+        {"sqlite_autoincrement": True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(250), nullable=False)
@@ -79,6 +145,16 @@ class Product(db.Model):
     category = db.Column(
         db.Enum(Category), nullable=False, server_default=(Category.UNKNOWN.name)
     )
+    # bumped by every UPDATE, which only applies if the version is unchanged
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Fields of a serialized Product, in order
+    FIELDS = ("id", "name", "description", "price", "available", "category")
+
+    # Fields that listings can be sorted and paged by
+    SORT_FIELDS = ("id", "name", "price", "available", "category")
 
     ##################################################
     # INSTANCE METHODS
@@ -96,6 +172,9 @@ class Product(db.Model):
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
         db.session.commit()
+        product_cache.invalidate(self.id)
+        stats_cache.clear()
+        product_names.add(self.name)
 
     def update(self):
         """
@@ -104,13 +183,32 @@ class Product(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        old_names = inspect(self).attrs.name.history.deleted
         db.session.commit()
+        product_cache.invalidate(self.id)
+        stats_cache.clear()
+        if old_names:
+            product_names.remove(old_names[0])
+            product_names.add(self.name)
 
     def delete(self):
         """Removes a Product from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
         db.session.commit()
+        product_cache.invalidate(self.id)
+        stats_cache.clear()
+        product_names.remove(self.name)
+
+    def to_mapping(self) -> dict:
+        """Returns the column values of a Product for bulk inserts"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "price": self.price,
+            "available": self.available,
+            "category": self.category,
+        }
 
     def serialize(self) -> dict:
         """Serializes a Product into a dictionary"""
@@ -130,6 +228,11 @@ class Product(db.Model):
             data (dict): A dictionary containing the Product data
         """
         try:
+            for key in ("name", "description"):
+                if not isinstance(data[key], str):
+                    raise DataValidationError(
+                        f"Invalid type for string [{key}]: {type(data[key])}"
+                    )
             self.name = data["name"]
             self.description = data["description"]
             self.price = Decimal(data["price"])
@@ -149,6 +252,8 @@ class Product(db.Model):
             raise DataValidationError(
                 "Invalid product: body of request contained bad or no data " + str(error)
             ) from error
+        except (InvalidOperation, ValueError) as error:
+            raise DataValidationError("Invalid price: " + str(data["price"])) from error
         return self
 
     ##################################################
@@ -157,17 +262,69 @@ class Product(db.Model):
 
     @classmethod
     def init_db(cls, app: Flask):
-        """Initializes the database session
+        """Initializes the database session without connecting to the database
 
         :param app: the Flask app
         :type data: Flask
 
         """
         logger.info("Initializing database")
-        # This is where we initialize SQLAlchemy from the Flask app
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in options:
+            # measure how long requests wait for a pooled connection
+            options.setdefault("poolclass", TimedQueuePool)
+        # This is where we initialize SQLAlchemy from the Flask app. Nothing
+        # connects to the database here: the engine is created on first use
+        # and the tables are created once per deployment by 'flask db-init'
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.configure(app)
+
+    @classmethod
+    def configure(cls, app: Flask):
+        """Applies the settings of an app to the caches and replicas
+
+        The caches, the name index and the replicas belong to the process,
+        not to an app, so the last app configured sets them for every app.
+
+        :param app: the Flask app
+        :type app: Flask
+
+        """
+        product_cache.configure(
+            app.config.get("PRODUCT_CACHE_SIZE", 1024), app.config.get("PRODUCT_CACHE_TTL", 60)
+        )
+        stats_cache.configure(stats_cache.maxsize, app.config.get("STATS_CACHE_TTL", 60))
+        replicas.configure(
+            app.config.get("DATABASE_REPLICA_URIS", []),
+            app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+            app.config.get("REPLICA_CHECK_INTERVAL", 10),
+            app.config.get("REPLICA_CONNECT_TIMEOUT", 2),
+        )
+        product_names.max_age = app.config.get("SUGGEST_MAX_AGE", 300)
+
+    @classmethod
+    def missing_indexes(cls) -> list:
+        """Returns the indexes declared on Product that the database lacks
+
+        create_all() only builds indexes for tables it creates, so a table
+        that already existed can be missing indexes added later.
+        """
+        existing = {
+            index["name"] for index in inspect(db.engine).get_indexes(cls.__tablename__)
+        }
+        return [index for index in cls.__table__.indexes if index.name not in existing]
+
+    @classmethod
+    def missing_columns(cls) -> list:
+        """Returns the columns declared on Product that the database lacks
+
+        Like indexes, columns added later (such as version) are not added
+        to an existing table by create_all().
+        """
+        existing = {
+            column["name"] for column in inspect(db.engine).get_columns(cls.__tablename__)
+        }
+        return [column for column in cls.__table__.columns if column.name not in existing]
 
     @classmethod
     def all(cls) -> list:
@@ -175,6 +332,493 @@ class Product(db.Model):
         logger.info("Processing all Products")
         return cls.query.all()
 
+    @classmethod
+    def bulk_create(cls, items, chunk_size: int = 1000) -> tuple:
+        """Creates many Products with one executemany INSERT per chunk
+
+        Every item is validated with deserialize() and the valid ones are
+        inserted ``chunk_size`` at a time, with a single commit per chunk.
+        Items that are DataValidationError instances (e.g. lines that could
+        not be parsed) are reported as failures like any invalid item. If
+        the database rejects a chunk, its items are inserted one at a time
+        so that only the ones it rejects fail.
+
+        :param items: an iterable of dictionaries containing Product data
+        :type items: iterable
+        :param chunk_size: the number of Products to insert per transaction
+        :type chunk_size: int
+
+        :return: the number of Products created and a list of failures as
+            (index, message) tuples
+        :rtype: tuple
+
+        """
+        logger.info("Processing bulk create in chunks of %s ...", chunk_size)
+        created = 0
+        failures = []
+        chunk = []
+
+        def insert(rows):
+            try:
+                db.session.bulk_insert_mappings(cls, [mapping for _, mapping in rows])
+                db.session.commit()
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                return str(getattr(error, "orig", None) or error)
+            for _, mapping in rows:
+                product_names.add(mapping["name"])
+            return None
+
+        def flush():
+            stats_cache.clear()
+            error = insert(chunk)
+            if error is None:
+                return len(chunk)
+            if len(chunk) == 1:
+                failures.append((chunk[0][0], error))
+                return 0
+            logger.warning("Bulk insert failed, retrying one at a time: %s", error)
+            count = 0
+            for index, mapping in chunk:
+                error = insert([(index, mapping)])
+                if error is None:
+                    count += 1
+                else:
+                    failures.append((index, error))
+            return count
+
+        for index, data in enumerate(items):
+            try:
+                if isinstance(data, DataValidationError):
+                    raise data
+                chunk.append((index, cls().deserialize(data).to_mapping()))
+            except DataValidationError as error:
+                failures.append((index, str(error)))
+            if len(chunk) >= chunk_size:
+                created += flush()
+                chunk = []
+        if chunk:
+            created += flush()
+        return created, failures
+
+    @classmethod
+    def update_many(cls, query, changes: dict) -> int:
+        """Updates every Product matched by a query with one UPDATE statement
+
+        :param query: the query selecting the Products to update
+        :type query: BaseQuery
+        :param changes: the new values keyed by attribute name
+        :type changes: dict
+
+        :return: the number of Products that were updated
+        :rtype: int
+
+        """
+        logger.info("Processing bulk update of %s ...", sorted(changes))
+        values = cls.deserialize_changes(changes)
+        values["version"] = cls.version + 1
+        count = query.update(values, synchronize_session=False)
+        db.session.commit()
+        product_cache.clear()
+        stats_cache.clear()
+        if "name" in values:
+            product_names.invalidate()
+        return count
+
+    @classmethod
+    def update_version(cls, product_id: int, version: int, product) -> bool:
+        """Updates a Product with a conditional UPDATE if it is still at a version
+
+        The UPDATE only matches the row while its version is unchanged and
+        bumps it, so an edit based on an older version does not overwrite a
+        newer one.
+
+        :param product_id: the id of the Product to update
+        :type product_id: int
+        :param version: the version the changes are based on
+        :type version: int
+        :param product: a Product holding the new values
+        :type product: Product
+
+        :return: True if the Product was updated, False if it does not
+            exist or is at another version
+        :rtype: bool
+
+        """
+        logger.info("Saving %s at version %d", product.name, version)
+        values = product.to_mapping()
+        values["version"] = version + 1
+        product_table = cls.__table__
+        statement = product_table.update().where(
+            product_table.c.id == product_id, product_table.c.version == version
+        ).values(**values)
+        matched, old_name = cls._write_version(statement)
+        if not matched:
+            return False
+        product.id = product_id
+        product.version = version + 1
+        product_cache.invalidate(product_id)
+        stats_cache.clear()
+        if old_name is None:
+            product_names.invalidate()  # the old name was not read
+        else:
+            product_names.remove(old_name)
+            product_names.add(product.name)
+        return True
+
+    @classmethod
+    def delete_version(cls, product_id: int, version: int) -> bool:
+        """Deletes a Product with a conditional DELETE if it is still at a version
+
+        :return: True if the Product was deleted, False if it does not
+            exist or is at another version
+        :rtype: bool
+
+        """
+        logger.info("Deleting product %d at version %d", product_id, version)
+        product_table = cls.__table__
+        statement = product_table.delete().where(
+            product_table.c.id == product_id, product_table.c.version == version
+        )
+        matched, old_name = cls._write_version(statement)
+        if not matched:
+            return False
+        product_cache.invalidate(product_id)
+        stats_cache.clear()
+        if old_name is None:
+            product_names.invalidate()
+        else:
+            product_names.remove(old_name)
+        return True
+
+    @classmethod
+    def _write_version(cls, statement) -> tuple:
+        """Runs an UPDATE or DELETE of one version and commits it
+
+        Returns whether a row matched and the name the Product had at that
+        version. Databases with RETURNING (PostgreSQL) return the old name
+        from the same statement, an UPDATE taking it from a copy of the row,
+        so the name index is updated in place. Elsewhere the statement runs
+        alone and the name is None, since reading it first would cost a
+        SELECT on every write.
+        """
+        if not db.engine.dialect.full_returning:
+            matched = bool(db.session.execute(statement).rowcount)
+            db.session.commit()
+            return matched, None
+        if isinstance(statement, Update):
+            old = cls.__table__.alias("old")
+            statement = statement.where(old.c.id == cls.id).returning(old.c.name)
+        else:
+            statement = statement.returning(cls.name)
+        old_name = db.session.execute(statement).scalar()
+        db.session.commit()
+        return old_name is not None, old_name
+
+    @classmethod
+    def delete_many(cls, query) -> int:
+        """Deletes every Product matched by a query with one DELETE statement
+
+        :param query: the query selecting the Products to delete
+        :type query: BaseQuery
+
+        :return: the number of Products that were deleted
+        :rtype: int
+
+        """
+        logger.info("Processing bulk delete ...")
+        count = query.delete(synchronize_session=False)
+        db.session.commit()
+        product_cache.clear()
+        stats_cache.clear()
+        product_names.invalidate()
+        return count
+
+    @classmethod
+    def deserialize_changes(cls, data: dict) -> dict:
+        """Validates a partial Product dictionary into column values
+
+        :param data: a dictionary with some of the Product attributes
+        :type data: dict
+
+        :return: the values to write keyed by column name
+        :rtype: dict
+
+        """
+        if not data:
+            raise DataValidationError("Invalid product: no values to change")
+        values = {}
+        for key, value in data.items():
+            if key in ("name", "description"):
+                if not isinstance(value, str):
+                    raise DataValidationError(f"Invalid type for string [{key}]: {type(value)}")
+                values[key] = value
+            elif key == "price":
+                values[key] = cls.to_price(value)
+            elif key == "available":
+                if not isinstance(value, bool):
+                    raise DataValidationError(
+                        "Invalid type for boolean [available]: " + str(type(value))
+                    )
+                values[key] = value
+            elif key == "category":
+                try:
+                    values[key] = getattr(Category, value)
+                except (AttributeError, TypeError) as error:
+                    raise DataValidationError("Invalid attribute: " + str(value)) from error
+            else:
+                raise DataValidationError("Invalid attribute: " + str(key))
+        return values
+
+    @classmethod
+    def paginate(
+        cls, query=None, limit: int = 100, cursor: str = None, serialized: bool = False,
+        sort: list = None, fields: list = None
+    ) -> tuple:
+        """Returns one page of Products using keyset (cursor) pagination
+
+        Rows are ordered by the sort keys (then id) and each page starts
+        strictly after the keys of the last row of the previous page, so
+        every page is a single index range scan no matter how deep the
+        caller pages. The cursor only works with the sort it came from.
+
+        :param query: the query to page through, defaults to all Products
+        :type query: BaseQuery
+        :param limit: the maximum number of Products to return
+        :type limit: int
+        :param cursor: the opaque token returned with the previous page
+        :type cursor: str
+        :param serialized: True to return dictionaries built by serialize_rows()
+        :type serialized: bool
+        :param sort: the sort keys returned by parse_sort(), defaults to id
+        :type sort: list
+        :param fields: the fields to serialize when serialized is True
+        :type fields: list
+
+        :return: the Products on this page and the cursor for the next page,
+            which is None when there are no more Products
+        :rtype: tuple
+
+        """
+        logger.info("Processing page query after cursor %s ...", cursor)
+        if query is None:
+            query = cls.query
+        keys = cls.sort_keys(sort)
+        if cursor:
+            values = cls.decode_cursor(cursor)
+            if len(values) != len(keys):
+                raise DataValidationError("Invalid cursor: " + cursor)
+            values = [cls.cursor_value(field, value) for (field, _), value in zip(keys, values)]
+            query = query.filter(cls.after_keys(keys, values))
+        # fetch one extra row to find out if there is another page
+        query = cls.order_by_keys(query, keys).limit(limit + 1)
+        selected = None
+        if fields:
+            # the sort keys are needed for the cursor even if not requested
+            sort_fields = {field for field, _ in keys}
+            selected = [field for field in cls.FIELDS if field in fields or field in sort_fields]
+        products = list(cls.serialize_rows(query, fields=selected)) if serialized else query.all()
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1] if serialized else products[-1].serialize()
+            next_cursor = cls.encode_cursor(*[last[field] for field, _ in keys])
+        if selected and selected != fields:
+            products = [{field: product[field] for field in fields} for product in products]
+        return products, next_cursor
+
+    @classmethod
+    def stream(
+        cls, query=None, batch_size: int = 500, serialized: bool = False, sort: list = None,
+        fields: list = None
+    ):
+        """Yields Products one at a time using a server-side cursor
+
+        :param query: the query to stream, defaults to all Products
+        :type query: BaseQuery
+        :param batch_size: the number of rows to fetch per round trip
+        :type batch_size: int
+        :param serialized: True to yield dictionaries built by serialize_rows()
+        :type serialized: bool
+        :param sort: the sort keys returned by parse_sort(), defaults to id
+        :type sort: list
+        :param fields: the fields to serialize when serialized is True
+        :type fields: list
+
+        :return: an iterator over the Products in sort order
+        :rtype: iterator
+
+        """
+        logger.info("Processing streaming query in batches of %s ...", batch_size)
+        if query is None:
+            query = cls.query
+        query = cls.order_by_keys(query, cls.sort_keys(sort))
+        if serialized:
+            return cls.serialize_rows(query, batch_size, fields)
+        return query.yield_per(batch_size)
+
+    @classmethod
+    def parse_sort(cls, sort: str) -> list:
+        """Parses a sort argument such as 'price,-name' into sort keys
+
+        :param sort: comma separated field names, each prefixed with '-'
+            for descending order
+        :type sort: str
+
+        :return: a list of (field, descending) tuples
+        :rtype: list
+
+        """
+        keys = []
+        for field in sort.split(","):
+            field = field.strip()
+            descending = field.startswith("-")
+            field = field.lstrip("-")
+            if field not in cls.SORT_FIELDS or field in [name for name, _ in keys]:
+                raise DataValidationError("Invalid sort field: " + field)
+            keys.append((field, descending))
+        return keys
+
+    @classmethod
+    def cursor_value(cls, field: str, value):
+        """Converts a sort key value read from a cursor back to a column value"""
+        if field == "price":
+            return cls.to_price(value)
+        if field == "category":
+            return cls.to_category(value)
+        expected = {"id": int, "name": str, "available": bool}[field]
+        if type(value) is not expected:  # pylint: disable=unidiomatic-typecheck
+            raise DataValidationError(f"Invalid cursor value for {field}: {value}")
+        return value
+
+    @classmethod
+    def sort_keys(cls, sort: list = None) -> list:
+        """Returns the sort keys with id added last to make the order total"""
+        keys = list(sort or [])
+        if "id" not in [field for field, _ in keys]:
+            keys.append(("id", False))
+        return keys
+
+    @classmethod
+    def order_by_keys(cls, query, keys: list):
+        """Orders a query by sort keys"""
+        return query.order_by(*[
+            getattr(cls, field).desc() if descending else getattr(cls, field).asc()
+            for field, descending in keys
+        ])
+
+    @classmethod
+    def after_keys(cls, keys: list, values: list):
+        """Returns the criterion for rows that sort after the given key values
+
+        This is the row value comparison (a, b, id) > (x, y, z) spelled out
+        so that each key can have its own direction.
+        """
+        clauses = []
+        for position, (field, descending) in enumerate(keys):
+            key_column = getattr(cls, field)
+            ties = [getattr(cls, name) == values[i] for i, (name, _) in enumerate(keys[:position])]
+            value = values[position]
+            if isinstance(value, bool):
+                # booleans only compare with IS, False sorts before True
+                if value == descending:
+                    beyond = key_column.is_(not value)
+                else:
+                    beyond = false()
+            elif descending:
+                beyond = key_column < value
+            else:
+                beyond = key_column > value
+            clauses.append(and_(*ties, beyond))
+        return or_(*clauses)
+
+    @classmethod
+    def serialize_rows(cls, query=None, batch_size: int = None, fields: list = None):
+        """Serializes the Products of a query without loading ORM objects
+
+        Only the columns are selected and each row tuple is turned straight
+        into the same dictionary that serialize() returns, which skips the
+        identity map and object construction for every row.
+
+        :param query: the query to serialize, defaults to all Products
+        :type query: BaseQuery
+        :param batch_size: the number of rows to fetch per round trip, or
+            None to fetch them all at once
+        :type batch_size: int
+        :param fields: the fields returned by parse_fields() to select and
+            serialize, defaults to all of them
+        :type fields: list
+
+        :return: a generator of serialized Products
+        :rtype: generator
+
+        """
+        if query is None:
+            query = cls.query
+        rows = query.with_entities(*cls.serialized_columns(fields))
+        if batch_size:
+            rows = rows.yield_per(batch_size)
+        for row in rows:
+            yield cls.serialize_row(row, fields)
+
+    @classmethod
+    def serialized_columns(cls, fields: list = None) -> tuple:
+        """Returns the columns that serialize_row() expects, in order"""
+        return tuple(getattr(cls, field) for field in fields or cls.FIELDS)
+
+    @staticmethod
+    def serialize_row(row, fields: list = None) -> dict:
+        """Serializes a row of serialized_columns() like serialize() does"""
+        if fields is None:
+            return {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "price": str(row[3]),
+                "available": row[4],
+                "category": row[5].name,
+            }
+        data = dict(zip(fields, row))
+        if "price" in data:
+            data["price"] = str(data["price"])
+        if "category" in data:
+            data["category"] = data["category"].name
+        return data
+
+    @classmethod
+    def parse_fields(cls, fields: str) -> list:
+        """Parses a fields argument such as 'id,name,price'
+
+        :param fields: comma separated field names
+        :type fields: str
+
+        :return: the field names in the order serialize() uses
+        :rtype: list
+
+        """
+        names = {field.strip() for field in fields.split(",")}
+        unknown = names - set(cls.FIELDS)
+        if unknown:
+            raise DataValidationError("Invalid fields: " + ", ".join(sorted(unknown)))
+        return [field for field in cls.FIELDS if field in names]
+
+    @staticmethod
+    def encode_cursor(*keys) -> str:
+        """Encodes the sort key values of a row into an opaque cursor"""
+        payload = json.dumps(list(keys), separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> list:
+        """Decodes a cursor created by encode_cursor() into its key values"""
+        try:
+            keys = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (binascii.Error, UnicodeError, ValueError) as error:
+            raise DataValidationError("Invalid cursor: " + cursor) from error
+        if not isinstance(keys, list) or not keys:
+            raise DataValidationError("Invalid cursor: " + cursor)
+        return keys
+
     @classmethod
     def find(cls, product_id: int):
         """Finds a Product by it's ID
@@ -189,6 +833,52 @@ class Product(db.Model):
         logger.info("Processing lookup for id %s ...", product_id)
         return cls.query.get(product_id)
 
+    @classmethod
+    def find_serialized(cls, product_id: int) -> tuple:
+        """Finds a Product by it's ID and returns it serialized with its ETag
+
+        Lookups are answered from the product cache when possible, so a hot
+        Product does not touch the database. The returned dictionary is
+        shared with the cache and must not be modified. Only reads from
+        the primary fill the cache, and a client that has just written
+        reads past it so that it sees its write.
+
+        :param product_id: the id of the Product to find
+        :type product_id: int
+
+        :return: the serialized Product and its ETag, or (None, None) if
+            not found
+        :rtype: tuple
+
+        """
+        entry = None if reading_own_writes() else product_cache.get(product_id)
+        if entry is None:
+            product = cls.find(product_id)
+            if product is None:
+                return None, None
+            data = product.serialize()
+            entry = (data, cls.version_etag(product.version))
+            if not reading_replica():
+                product_cache.set(product_id, entry)
+        return entry
+
+    @staticmethod
+    def version_etag(version: int, fields: list = None) -> str:
+        """Returns the ETag of a Product at a version
+
+        A projection of some fields gets its own ETag that still starts
+        with the version, so it revalidates and matches If-Match the same.
+        """
+        if fields:
+            return f"v{version}-" + "+".join(fields)
+        return f"v{version}"
+
+    @staticmethod
+    def etag_version(etag: str) -> int:
+        """Returns the version in an ETag from version_etag(), or None"""
+        match = re.match(r"^v(\d+)(-|$)", etag)
+        return int(match.group(1)) if match else None
+
     @classmethod
     def find_by_name(cls, name: str) -> list:
         """Returns all Products with the given name
@@ -215,10 +905,7 @@ class Product(db.Model):
 
         """
         logger.info("Processing price query for %s ...", price)
-        price_value = price
-        if isinstance(price, str):
-            price_value = Decimal(price.strip(' "'))
-        return cls.query.filter(cls.price == price_value)
+        return cls.query.filter(cls.price == cls.to_price(price))
 
     @classmethod
     def find_by_availability(cls, available: bool = True) -> list:
@@ -238,12 +925,341 @@ class Product(db.Model):
     def find_by_category(cls, category: Category = Category.UNKNOWN) -> list:
         """Returns all Products by their Category
 
-        :param category: values are ['MALE', 'FEMALE', 'UNKNOWN']
-        :type available: enum
+        :param category: a Category or the name of one, e.g. 'FOOD'
+        :type category: Category or str
 
         :return: a collection of Products that are available
         :rtype: list
 
         """
+        category = cls.to_category(category)
         logger.info("Processing category query for %s ...", category.name)
         return cls.query.filter(cls.category == category)
+
+    @classmethod
+    def find_by_filters(
+        cls, category=None, name: str = None, available: bool = None,
+        min_price=None, max_price=None
+    ):
+        """Returns the Products that match every one of the given criteria
+
+        All of the criteria are combined into a single WHERE clause so the
+        result comes back in one round trip. Criteria that are None are
+        ignored.
+
+        :param category: a Category or the name of one
+        :type category: Category or str
+        :param name: the exact name to match
+        :type name: str
+        :param available: True or False to match the availability
+        :type available: bool
+        :param min_price: the lowest price to include
+        :type min_price: Decimal or str
+        :param max_price: the highest price to include
+        :type max_price: Decimal or str
+
+        :return: a query for the matching Products
+        :rtype: BaseQuery
+
+        """
+        logger.info(
+            "Processing filter query for category=%s name=%s available=%s price=[%s, %s] ...",
+            category, name, available, min_price, max_price,
+        )
+        return cls.query.filter(
+            *cls.filter_criteria(category, name, available, min_price, max_price)
+        )
+
+    @classmethod
+    def filter_criteria(
+        cls, category=None, name: str = None, available: bool = None,
+        min_price=None, max_price=None
+    ) -> list:
+        """Returns the WHERE criteria used by find_by_filters()
+
+        The criteria can also be applied to a Core select() statement, which
+        is how the async serving mode runs the same query.
+        """
+        criteria = []
+        if category is not None:
+            criteria.append(cls.category == cls.to_category(category))
+        if name is not None:
+            criteria.append(cls.name == name)
+        if available is not None:
+            criteria.append(cls.available == available)
+        if min_price is not None:
+            criteria.append(cls.price >= cls.to_price(min_price))
+        if max_price is not None:
+            criteria.append(cls.price <= cls.to_price(max_price))
+        return criteria
+
+    @classmethod
+    def search(cls, terms: str, limit: int = 100, offset: int = 0) -> list:
+        """Returns the Products whose name or description match every term
+
+        Results are ranked by relevance using the full-text index of the
+        database (FTS5 on SQLite, tsvector on PostgreSQL). Other databases
+        fall back to a substring match ordered by id.
+
+        :param terms: the words to search for
+        :type terms: str
+        :param limit: the maximum number of Products to return
+        :type limit: int
+        :param offset: the number of ranked Products to skip
+        :type offset: int
+
+        :return: a list of Products, best match first
+        :rtype: list
+
+        """
+        logger.info("Processing search query for %s ...", terms)
+        words = re.findall(r"\w+", terms)
+        if not words:
+            raise DataValidationError("Invalid search: no words in " + repr(terms))
+        dialect = db.engine.dialect.name
+        if dialect == "sqlite":
+            fts = table("product_fts", column("rowid"))
+            match = " ".join('"' + word + '"' for word in words)
+            query = (
+                cls.query.join(fts, fts.c.rowid == cls.id)
+                .filter(literal_column("product_fts").op("MATCH")(match))
+                .order_by(func.bm25(literal_column("product_fts")), cls.id)
+            )
+        elif dialect == "postgresql":
+            document = literal_column(SEARCH_DOCUMENT)
+            tsquery = func.plainto_tsquery("english", " ".join(words))
+            query = cls.query.filter(document.op("@@")(tsquery)).order_by(
+                func.ts_rank(document, tsquery).desc(), cls.id
+            )
+        else:
+            query = cls.query.filter(
+                *[or_(cls.name.ilike(f"%{word}%"), cls.description.ilike(f"%{word}%"))
+                  for word in words]
+            ).order_by(cls.id)
+        return query.limit(limit).offset(offset).all()
+
+    @classmethod
+    def create_search_index(cls, connection):
+        """Creates the full-text search index if the database lacks it
+
+        The FTS5 table on SQLite is rebuilt from the product table, which is
+        needed when it is added to a table that already has rows.
+        """
+        dialect = connection.dialect.name
+        for statement in SEARCH_DDL.get(dialect, []):
+            connection.execute(text(statement))
+        if dialect == "sqlite":
+            connection.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+    @classmethod
+    def stats(cls, available: bool = None, min_price=None, max_price=None) -> list:
+        """Returns the count, prices and availability of each Category
+
+        The figures come from a single GROUP BY query and are cached until
+        a Product is written (or STATS_CACHE_TTL runs out, for writes made
+        by other processes).
+
+        :param available: True or False to only count that availability
+        :type available: bool
+        :param min_price: the lowest price to include
+        :type min_price: Decimal or str
+        :param max_price: the highest price to include
+        :type max_price: Decimal or str
+
+        :return: one dictionary per Category that has Products
+        :rtype: list
+
+        """
+        criteria = cls.filter_criteria(
+            available=available, min_price=min_price, max_price=max_price
+        )
+        key = (
+            available,
+            None if min_price is None else cls.to_price(min_price),
+            None if max_price is None else cls.to_price(max_price),
+        )
+        results = None if reading_own_writes() else stats_cache.get(key)
+        if results is not None:
+            return results
+
+        logger.info("Processing stats query for %s ...", key)
+        rows = (
+            db.session.query(
+                cls.category,
+                func.count(cls.id),
+                func.min(cls.price),
+                func.avg(cls.price),
+                func.max(cls.price),
+                func.avg(case((cls.available, 1.0), else_=0.0)),
+            )
+            .filter(*criteria)
+            .group_by(cls.category)
+            .all()
+        )
+        results = [
+            {
+                "category": category.name,
+                "count": count,
+                "min_price": str(min_value),
+                "avg_price": str(Decimal(avg_value).quantize(Decimal("0.01"))),
+                "max_price": str(max_value),
+                "available_ratio": round(float(ratio), 4),
+            }
+            for category, count, min_value, avg_value, max_value, ratio in rows
+        ]
+        results.sort(key=lambda result: result["category"])
+        if not reading_replica():
+            stats_cache.set(key, results)
+        return results
+
+    @classmethod
+    def suggest_names(cls, prefix: str, limit: int = 10) -> list:
+        """Returns Product names that start with a prefix for type-ahead
+
+        Names come from the in-memory index, which is rebuilt from the
+        database when it is older than SUGGEST_MAX_AGE so that writes made
+        by other processes show up.
+
+        :param prefix: the start of the name, in any case
+        :type prefix: str
+        :param limit: the maximum number of names to return
+        :type limit: int
+
+        :return: the matching names in alphabetical order
+        :rtype: list
+
+        """
+        if product_names.is_stale():
+            cls.rebuild_name_index()
+        return product_names.suggest(prefix, limit)
+
+    @classmethod
+    def rebuild_name_index(cls):
+        """Loads every Product name into the type-ahead index
+
+        The names are read from the primary even in a read-only request:
+        the index is kept for SUGGEST_MAX_AGE and must not start out behind.
+        """
+        logger.info("Building the product name index")
+        names = db.session.execute(select(cls.name), bind=db.engine).scalars()
+        product_names.rebuild(names)
+
+    @staticmethod
+    def to_category(value) -> Category:
+        """Converts a Category name (in any case) to a Category"""
+        if isinstance(value, Category):
+            return value
+        try:
+            return Category[str(value).upper()]
+        except KeyError as error:
+            raise DataValidationError("Invalid category: " + str(value)) from error
+
+    @staticmethod
+    def to_price(value) -> Decimal:
+        """Converts a price given as a number or string to a Decimal"""
+        if isinstance(value, str):
+            value = value.strip(' "')
+        try:
+            return Decimal(value)
+        except (InvalidOperation, TypeError, ValueError) as error:
+            raise DataValidationError("Invalid price: " + str(value)) from error
+
+
+@event.listens_for(Product.__table__, "after_create")
+def on_product_create(_target, connection, **_kwargs):
+    """Creates the full-text search index along with the product table"""
+    Product.create_search_index(connection)
+
+
+@event.listens_for(Product.__table__, "before_drop")
+def on_product_drop(_target, connection, **_kwargs):
+    """Drops the SQLite full-text table, which is not dropped with the table"""
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("DROP TABLE IF EXISTS product_fts"))
+
+
+class IdempotencyKey(db.Model):
+    """
+    Class that represents the stored response to a request with an
+    Idempotency-Key header
+
+    A row without a status is a claim: the first request with the key is
+    still running. Once it has answered, the row holds its status and
+    body until expires_at so that retries get the same answer.
+    """
+
+    __tablename__ = "idempotency_key"
+
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} status=[{self.status}]>"
+
+    @classmethod
+    def claim(cls, key: str, fingerprint: str, lease: float):
+        """Claims a key for a new request
+
+        Returns None if the key is now claimed for the caller, or the
+        existing row (a claim or a stored response) otherwise. A row that
+        has expired is replaced, so a claim whose request died is taken
+        over once its lease of a few seconds has run out. If the key keeps
+        changing hands, an unsaved claim is returned so that the caller
+        polls again.
+        """
+        now = datetime.utcnow()
+        values = {
+            "key": key, "fingerprint": fingerprint, "expires_at": now + timedelta(seconds=lease)
+        }
+        for _ in range(2):
+            try:
+                db.session.execute(cls.__table__.insert().values(**values))
+                db.session.commit()
+                return None
+            except IntegrityError:
+                db.session.rollback()
+            existing = db.session.query(
+                cls.fingerprint, cls.status, cls.body, cls.expires_at
+            ).filter(cls.key == key).first()
+            db.session.commit()
+            if existing is not None and existing.expires_at > now:
+                return existing
+            db.session.query(cls).filter(cls.key == key, cls.expires_at <= now).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+        return cls(key=key, fingerprint=fingerprint)
+
+    @classmethod
+    def complete(cls, key: str, status: int, body: str, ttl: float):
+        """Stores the response to the request that claimed a key"""
+        db.session.query(cls).filter(cls.key == key).update(
+            {
+                "status": status,
+                "body": body,
+                "expires_at": datetime.utcnow() + timedelta(seconds=ttl),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    @classmethod
+    def release(cls, key: str):
+        """Gives up the claim on a key so that a retry runs the request again"""
+        db.session.rollback()
+        db.session.query(cls).filter(cls.key == key, cls.status.is_(None)).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    @classmethod
+    def purge(cls) -> int:
+        """Deletes every expired row and returns how many there were"""
+        count = db.session.query(cls).filter(cls.expires_at <= datetime.utcnow()).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return count
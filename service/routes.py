@@ -1,29 +1,282 @@
-from flask import jsonify, request, abort
-from service.models import Product
-from service.common.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
 
-@app.route("/products", methods=["GET"])
-def list_products():
-    """List all products or filter by optional parameters"""
-    category = request.args.get("category")
-    name = request.args.get("name")
+"""
+Product Store Service
+
+Paths:
+------
+GET /products - Returns a list of all of the Products
+GET /products?limit=N&cursor=X - Returns one page of Products
+GET /products?sort=price,-name - Returns the Products in the given order
+GET /products?stream=true - Streams the Products as a chunked JSON array
+GET /products?fields=id,name - Returns only the given fields of each Product
+POST /products - Creates a new Product record in the database
+POST /products with Idempotency-Key - Creates it once, replaying the response to retries
+POST /products/bulk - Creates many Product records from a JSON array or NDJSON
+PATCH /products/bulk - Updates every Product selected by ids or filters
+DELETE /products/bulk - Deletes every Product selected by ids or filters
+GET /products/search?q=text - Returns the Products that best match the text
+GET /products/stats - Returns the count, prices and availability per Category
+GET /products/suggest?prefix=text - Returns Product names starting with text
+GET /products/{id} - Returns the Product with a given id number
+PUT /products/{id} - Updates a Product record in the database
+DELETE /products/{id} - Deletes a Product record in the database
+GET /metrics - Returns the request metrics in the Prometheus text format
+GET /metrics/cache - Returns the product cache counters
+GET /metrics/pool - Returns the database connection pool usage
+GET /metrics/replicas - Returns the read replicas and their health
+"""
+from flask import (
+    Blueprint, Response, abort, current_app, json, jsonify, request, stream_with_context
+)
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import Product, DataValidationError, db, product_cache, replicas
+from service.common.idempotency import idempotent
+from service.common.pool import pool_stats
+from service.common.metrics import render as render_metrics
+from service.common.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_204_NO_CONTENT,
+    HTTP_207_MULTI_STATUS,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    HTTP_412_PRECONDITION_FAILED,
+)
+
+bp = Blueprint("products", __name__)  # pylint: disable=invalid-name
+
+NDJSON = "application/x-ndjson"
+# Separators of jsonify(), which the JSON encoder writes with orjson
+COMPACT = (",", ":")
+MAX_SUGGESTIONS = 50
+FILTERS = {"category", "name", "available", "min_price", "max_price"}
+
+
+######################################################################
+# U T I L I T Y   F U N C T I O N S
+######################################################################
+def get_page_limit():
+    """Returns the requested page size, clamped to MAX_PAGE_SIZE"""
+    limit = request.args.get("limit")
+    if limit is None:
+        return current_app.config["DEFAULT_PAGE_SIZE"]
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(HTTP_400_BAD_REQUEST, f"Invalid limit: {limit}")
+    if limit < 1:
+        abort(HTTP_400_BAD_REQUEST, f"Invalid limit: {limit}")
+    return min(limit, current_app.config["MAX_PAGE_SIZE"])
+
+
+def filter_products():
+    """Returns a query for the Products selected by the request arguments
+
+    Any combination of category, name, available, min_price and max_price
+    may be given; they are all applied together.
+    """
     available = request.args.get("available")
+    return Product.find_by_filters(
+        category=request.args.get("category") or None,
+        name=request.args.get("name") or None,
+        available=available == "true" if available else None,
+        min_price=request.args.get("min_price") or None,
+        max_price=request.args.get("max_price") or None,
+    )
 
-    if category:
-        products = Product.find_by_category(category)
-    elif name:
-        products = Product.find_by_name(name)
-    elif available:
-        products = Product.find_by_availability(available == "true")
-    else:
-        products = Product.all()
 
-    return jsonify([product.serialize() for product in products]), HTTP_200_OK
+def select_bulk_target(data: dict):
+    """Returns a query for the Products targeted by a bulk request
+
+    Products are selected by an ``ids`` list in the request body and/or the
+    same filters that GET /products accepts. At least one of them must be
+    given so that a bulk request never touches the whole table by accident.
+    An empty filter value or ids list is rejected rather than ignored.
+    """
+    ids = data.get("ids")
+    filters = set(request.args) & FILTERS
+    empty = sorted(name for name in filters if not request.args.get(name))
+    if empty:
+        abort(HTTP_400_BAD_REQUEST, f"Bulk filters must not be empty: {', '.join(empty)}")
+    # booleans are ints to isinstance(), and true would select id 1
+    if ids is not None and (
+        not isinstance(ids, list) or not ids
+        or not all(type(i) is int for i in ids)  # pylint: disable=unidiomatic-typecheck
+    ):
+        abort(HTTP_400_BAD_REQUEST, "ids must be a non-empty list of integers")
+    if ids is None and not filters:
+        abort(HTTP_400_BAD_REQUEST, "Bulk requests need a list of ids or a filter")
+    products = filter_products()
+    if ids is not None:
+        products = products.filter(Product.id.in_(ids))
+    return products
+
+
+def read_ndjson(stream):
+    """Yields the documents of a newline delimited JSON stream one at a time
+
+    Lines that are not valid JSON are yielded as DataValidationError
+    instances so the caller can report them without stopping the stream.
+    """
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield DataValidationError(f"Invalid JSON on line {number}")
+
+
+def conditional_response(data) -> Response:
+    """Returns data as JSON with a strong ETag, or a 304 if it is unchanged"""
+    response = jsonify(data)
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def get_fields():
+    """Returns the fields requested with the fields argument, or None for all"""
+    fields = request.args.get("fields")
+    return Product.parse_fields(fields) if fields else None
+
+
+def if_match_version(product_id: int):
+    """Returns the version that If-Match requires, or None without a condition
+
+    Version ETags are compared weakly, so a W/ ETag from a compressed
+    response matches as well. An ETag that is not a version can never
+    match and fails the precondition.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    etags = if_match.as_set(include_weak=True)
+    versions = [Product.etag_version(etag) for etag in etags]
+    versions = [version for version in versions if version is not None]
+    if len(versions) != 1:
+        abort(HTTP_412_PRECONDITION_FAILED, f"Product with id {product_id} does not match If-Match")
+    return versions[0]
+
+
+def precondition_failed(product_id: int):
+    """Aborts with 404 if the Product is gone, or with 412 if it has changed
+
+    The cached copy is dropped either way, as another worker may have made
+    the change and the client will GET the new version next.
+    """
+    product_cache.invalidate(product_id)
+    if Product.find(product_id) is None:
+        abort(HTTP_404_NOT_FOUND, f"Product with id {product_id} not found")
+    abort(HTTP_412_PRECONDITION_FAILED, f"Product with id {product_id} has been changed")
+
+
+def wants_ndjson():
+    """Checks if the client asked for newline delimited JSON"""
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON])
+    return best == NDJSON
+
+
+def stream_products(query, ndjson: bool, sort: list = None, fields: list = None) -> Response:
+    """Streams the Products of a query without buffering the whole result
+
+    Rows are read through a server-side cursor in batches of
+    STREAM_BATCH_SIZE and every Product is written out as soon as it has
+    been serialized, so memory stays flat and the first byte goes out
+    before the last row is read.
+    """
+    products = Product.stream(
+        query, current_app.config["STREAM_BATCH_SIZE"], serialized=True, sort=sort, fields=fields
+    )
+
+    def generate_ndjson():
+        for product in products:
+            yield json.dumps(product, separators=COMPACT) + "\n"
+
+    def generate_array():
+        separator = "["
+        for product in products:
+            yield separator + json.dumps(product, separators=COMPACT)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    if ndjson:
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON)
+    return Response(stream_with_context(generate_array()), mimetype="application/json")
+
+
+######################################################################
+# R E S T   A P I   E N D P O I N T S
+######################################################################
+
+@bp.route("/products", methods=["GET"])
+def list_products():
+    """List all products or filter by optional parameters
+
+    When ``limit`` or ``cursor`` is given the results are returned one page
+    at a time and the token for the following page is sent back in the
+    ``X-Next-Cursor`` header (absent on the last page).
+
+    Clients that send ``Accept: application/x-ndjson`` get one Product per
+    line, and ``stream=true`` streams a regular JSON array. Both are
+    written out while the rows are still being read from the database.
+
+    Buffered listings carry an ETag and honor If-None-Match with a 304.
+
+    ``sort`` orders the results by comma separated fields, each prefixed
+    with ``-`` for descending order, e.g. ``sort=price,-name``. Together
+    with ``limit`` it returns the top N rows and pages by those fields.
+
+    ``fields`` selects and returns only the given fields of each Product,
+    e.g. ``fields=id,name,price``.
+    """
+    products = filter_products()
+    sort = request.args.get("sort")
+    sort = Product.parse_sort(sort) if sort else None
+    fields = get_fields()
+
+    if "limit" not in request.args and "cursor" not in request.args:
+        if wants_ndjson() or request.args.get("stream") == "true":
+            return stream_products(products, wants_ndjson(), sort, fields)
+        if sort:
+            products = Product.order_by_keys(products, Product.sort_keys(sort))
+        return conditional_response(list(Product.serialize_rows(products, fields=fields)))
+
+    limit = get_page_limit()
+    products, next_cursor = Product.paginate(
+        products, limit, request.args.get("cursor"), serialized=True, sort=sort,
+        fields=fields
+    )
+    response = conditional_response(products)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
-@app.route("/products", methods=["POST"])
+@bp.route("/products", methods=["POST"])
+@idempotent
 def create_product():
-    """Create a new product"""
+    """Create a new product
+
+    Retries that send the same Idempotency-Key get the stored response
+    instead of creating the product again.
+    """
     data = request.get_json()
     product = Product()
     product.deserialize(data)
@@ -31,35 +284,212 @@ def create_product():
     return jsonify(product.serialize()), HTTP_201_CREATED
 
 
-@app.route("/products/<int:product_id>", methods=["GET"])
+@bp.route("/products/bulk", methods=["POST"])
+def create_products_bulk():
+    """Create many products at once
+
+    The body is either a JSON array of products or, with a Content-Type of
+    application/x-ndjson, one product per line. Products are inserted in
+    chunks of BULK_CHUNK_SIZE with one commit per chunk, and every item
+    that could not be created is reported by its position in the input.
+    """
+    if request.mimetype == NDJSON:
+        items = read_ndjson(request.stream)
+    else:
+        items = request.get_json()
+        if not isinstance(items, list):
+            abort(HTTP_400_BAD_REQUEST, "Request body must be a JSON array of products")
+
+    created, failures = Product.bulk_create(items, current_app.config["BULK_CHUNK_SIZE"])
+    failed = [{"index": index, "error": message} for index, message in failures]
+    status = HTTP_207_MULTI_STATUS if failed else HTTP_201_CREATED
+    return jsonify(created=created, failed=failed), status
+
+
+@bp.route("/products/bulk", methods=["PATCH"])
+def update_products_bulk():
+    """Update every product selected by ids or filters in one statement
+
+    The body holds the new values under ``set`` and optionally the ``ids``
+    of the products to change, e.g. ``PATCH /products/bulk?category=FOOD``
+    with ``{"set": {"available": false}}``.
+    """
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get("set"), dict):
+        abort(HTTP_400_BAD_REQUEST, "Request body must contain the values to set")
+    products = select_bulk_target(data)
+    count = Product.update_many(products, data["set"])
+    return jsonify(updated=count), HTTP_200_OK
+
+
+@bp.route("/products/bulk", methods=["DELETE"])
+def delete_products_bulk():
+    """Delete every product selected by ids or filters in one statement"""
+    data = request.get_json(silent=True) or {}
+    products = select_bulk_target(data)
+    count = Product.delete_many(products)
+    return jsonify(deleted=count), HTTP_200_OK
+
+
+@bp.route("/products/search", methods=["GET"])
+def search_products():
+    """Full-text search over product names and descriptions
+
+    Products are ranked by relevance and returned ``limit`` at a time; the
+    cursor for the next page is sent in the ``X-Next-Cursor`` header.
+    """
+    terms = request.args.get("q")
+    if not terms:
+        abort(HTTP_400_BAD_REQUEST, "Search needs a q parameter")
+    limit = get_page_limit()
+    offset = 0
+    cursor = request.args.get("cursor")
+    if cursor:
+        keys = Product.decode_cursor(cursor)
+        if len(keys) != 1 or not isinstance(keys[0], int) or keys[0] < 0:
+            abort(HTTP_400_BAD_REQUEST, f"Invalid cursor: {cursor}")
+        offset = keys[0]
+
+    products = Product.search(terms, limit + 1, offset)
+    response = jsonify([product.serialize() for product in products[:limit]])
+    if len(products) > limit:
+        response.headers["X-Next-Cursor"] = Product.encode_cursor(offset + limit)
+    return response
+
+
+@bp.route("/products/stats", methods=["GET"])
+def product_stats():
+    """Return per-category statistics computed by the database
+
+    The optional available, min_price and max_price arguments restrict
+    which products are counted.
+    """
+    available = request.args.get("available")
+    stats = Product.stats(
+        available=available == "true" if available else None,
+        min_price=request.args.get("min_price") or None,
+        max_price=request.args.get("max_price") or None,
+    )
+    return jsonify(stats), HTTP_200_OK
+
+
+@bp.route("/products/suggest", methods=["GET"])
+def suggest_products():
+    """Return product names that start with a prefix, for type-ahead
+
+    Names are answered from memory in alphabetical order, at most
+    ``limit`` of them (10 by default).
+    """
+    prefix = request.args.get("prefix", "")
+    limit = request.args.get("limit", 10, type=int)
+    if not prefix or limit < 1:
+        abort(HTTP_400_BAD_REQUEST, "Suggest needs a prefix and a positive limit")
+    names = Product.suggest_names(prefix, min(limit, MAX_SUGGESTIONS))
+    return jsonify(names), HTTP_200_OK
+
+
+@bp.route("/products/<int:product_id>", methods=["GET"])
 def get_product(product_id):
-    """Retrieve a product by ID"""
-    product = Product.find(product_id)
+    """Retrieve a product by ID
+
+    The response carries the version of the Product as its ETag and a
+    request whose If-None-Match already holds it gets a 304 before the body
+    is encoded.
+
+    ``fields`` returns only the given fields, e.g. ``fields=id,price``.
+    """
+    fields = get_fields()
+    product, etag = Product.find_serialized(product_id)
     if not product:
         abort(HTTP_404_NOT_FOUND, f"Product with id {product_id} not found")
-    return jsonify(product.serialize()), HTTP_200_OK
+    if fields:
+        product = {field: product[field] for field in fields}
+        etag = Product.version_etag(Product.etag_version(etag), fields)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=HTTP_304_NOT_MODIFIED)
+    else:
+        response = jsonify(product)
+    response.set_etag(etag)
+    return response
 
 
-@app.route("/products/<int:product_id>", methods=["PUT"])
+@bp.route("/products/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
-    """Update an existing product"""
-    product = Product.find(product_id)
-    if not product:
-        abort(HTTP_404_NOT_FOUND, f"Product with id {product_id} not found")
+    """Update an existing product
 
-    data = request.get_json()
-    product.deserialize(data)
-    product.update()
-    return jsonify(product.serialize()), HTTP_200_OK
+    With ``If-Match`` holding the ETag of the version the client edited,
+    the Product is written with an UPDATE that only applies if it is
+    still at that version, and 412 is returned if it has changed since.
+    """
+    version = if_match_version(product_id)
+    if version is not None:
+        product = Product()
+        product.deserialize(request.get_json())
+        if not Product.update_version(product_id, version, product):
+            precondition_failed(product_id)
+    else:
+        product = Product.find(product_id)
+        if not product:
+            abort(HTTP_404_NOT_FOUND, f"Product with id {product_id} not found")
+        product.deserialize(request.get_json())
+        try:
+            product.update()
+        except StaleDataError:
+            db.session.rollback()
+            product_cache.invalidate(product_id)
+            abort(HTTP_412_PRECONDITION_FAILED, f"Product with id {product_id} has been changed")
 
+    response = jsonify(product.serialize())
+    response.set_etag(Product.version_etag(product.version))
+    return response, HTTP_200_OK
 
-@app.route("/products/<int:product_id>", methods=["DELETE"])
+
+@bp.route("/products/<int:product_id>", methods=["DELETE"])
 def delete_product(product_id):
-    """Delete a product by ID"""
+    """Delete a product by ID
+
+    With ``If-Match`` the Product is only deleted if it is still at the
+    version of the ETag, otherwise 412 is returned.
+    """
+    version = if_match_version(product_id)
+    if version is not None:
+        if not Product.delete_version(product_id, version):
+            precondition_failed(product_id)
+        return "", HTTP_204_NO_CONTENT
+
     product = Product.find(product_id)
     if not product:
         abort(HTTP_404_NOT_FOUND, f"Product with id {product_id} not found")
 
-    product.delete()
+    try:
+        product.delete()
+    except StaleDataError:
+        db.session.rollback()
+        product_cache.invalidate(product_id)
+        abort(HTTP_412_PRECONDITION_FAILED, f"Product with id {product_id} has been changed")
     return "", HTTP_204_NO_CONTENT
 
+
+@bp.route("/metrics", methods=["GET"])
+def request_metrics():
+    """Return the request counts, latencies and in-flight requests per route"""
+    body, content_type = render_metrics()
+    return Response(body, status=HTTP_200_OK, content_type=content_type)
+
+
+@bp.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    """Return the hit, miss and eviction counters of the product cache"""
+    return jsonify(product_cache.stats()), HTTP_200_OK
+
+
+@bp.route("/metrics/pool", methods=["GET"])
+def pool_metrics():
+    """Return the checked out, idle and overflow connections and wait times"""
+    return jsonify(pool_stats(db.engine.pool)), HTTP_200_OK
+
+
+@bp.route("/metrics/replicas", methods=["GET"])
+def replica_metrics():
+    """Return the read replicas and whether each is in rotation"""
+    return jsonify(replicas.stats()), HTTP_200_OK
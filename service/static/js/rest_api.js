@@ -33,6 +33,32 @@ $(function () {
         $("#flash_message").append(message);
     }
 
+    // ****************************************
+    // Suggest Product names while typing
+    // ****************************************
+
+    $("#product_name").on("input", function () {
+
+        let prefix = $("#product_name").val();
+        if (prefix.length == 0) {
+            $("#product_name_suggestions").empty();
+            return;
+        }
+
+        let ajax = $.ajax({
+            type: "GET",
+            url: `/products/suggest?prefix=${encodeURIComponent(prefix)}`,
+            contentType: "application/json",
+        });
+
+        ajax.done(function(res){
+            $("#product_name_suggestions").empty();
+            for (let i = 0; i < res.length; i++) {
+                $("#product_name_suggestions").append($("<option>").attr("value", res[i]));
+            }
+        });
+    });
+
     // ****************************************
     // Create a Product
     // ****************************************
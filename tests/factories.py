@@ -35,7 +35,7 @@ class ProductFactory(factory.Factory):
     description = factory.Faker('sentence')  # Generates a random product description
     price = FuzzyDecimal(1.0, 1000.0, 2)  # Generates a random price between 1.0 and 1000.0 with 2 decimal places
     available = FuzzyChoice([True, False])  # Randomly choose True or False for availability
-    category = factory.SubFactory('tests.factories.CategoryFactory')  # Generates a random Category using CategoryFactory
+    category = FuzzyChoice(list(Category))  # Randomly choose one of the Category values
 
 
 class CategoryFactory(factory.Factory):
@@ -0,0 +1,181 @@
+"""
+Test cases for the ASGI serving mode
+"""
+import os
+import gzip
+import json
+import asyncio
+import contextvars
+import tempfile
+import unittest
+from service import app
+from service.models import db, product_cache
+from tests.factories import ProductFactory
+from tests.helpers import sample_value
+
+try:
+    import aiosqlite  # noqa: F401 pylint: disable=unused-import
+    from service.asgi import AsyncProductApp, async_database_uri
+    HAS_ASYNC = True
+except ImportError:  # pragma: no cover
+    HAS_ASYNC = False
+
+
+def call(asgi_app, path: str, query: str = "", headers: dict = None, method: str = "GET"):
+    """Calls an ASGI app and returns the status, headers and body"""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 12345),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await asgi_app(scope, receive, send)
+        await asgi_app.engine.dispose()
+
+    # run in an empty context like a server would, so that the test's app
+    # context does not leak into the requests passed on to Flask
+    contextvars.Context().run(asyncio.run, run())
+    start = messages[0]
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    response_headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], response_headers, body
+
+
+@unittest.skipUnless(HAS_ASYNC, "asgiref and aiosqlite are not installed")
+class TestAsyncProductApp(unittest.TestCase):
+    """Test the ASGI app against the Flask app"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        self.db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        self.db_file.close()
+        self.old_uri = app.config["SQLALCHEMY_DATABASE_URI"]
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{self.db_file.name}"
+        db.create_all()
+        product_cache.clear()
+        self.client = app.test_client()
+        self.asgi = AsyncProductApp(app)
+        self.asgi.get_engine()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        app.config["SQLALCHEMY_DATABASE_URI"] = self.old_uri
+        os.unlink(self.db_file.name)
+
+    def _create_products(self, count: int) -> list:
+        """Creates products through the Flask app"""
+        return [
+            self.client.post("/products", json=ProductFactory().serialize()).get_json()
+            for _ in range(count)
+        ]
+
+    def test_async_database_uri(self):
+        """It should pick the async driver for a database URI"""
+        self.assertEqual(
+            async_database_uri("postgresql://u:p@host:5432/db"),
+            "postgresql+asyncpg://u:p@host:5432/db",
+        )
+        self.assertEqual(async_database_uri("sqlite:///test.db"), "sqlite+aiosqlite:///test.db")
+
+    def test_get_product(self):
+        """It should return the same product and ETag as the Flask app"""
+        product = self._create_products(1)[0]
+        product_cache.clear()
+        expected = self.client.get(f"/products/{product['id']}")
+        product_cache.clear()
+        code, headers, body = call(self.asgi, f"/products/{product['id']}")
+        self.assertEqual(code, 200)
+        self.assertEqual(body, expected.get_data())
+        self.assertEqual(headers["etag"], expected.headers["ETag"])
+
+        code, _, body = call(
+            self.asgi, f"/products/{product['id']}", headers={"If-None-Match": headers["etag"]}
+        )
+        self.assertEqual(code, 304)
+        self.assertEqual(body, b"")
+
+    def test_get_product_not_found(self):
+        """It should return the same 404 as the Flask app"""
+        expected = self.client.get("/products/0")
+        code, _, body = call(self.asgi, "/products/0")
+        self.assertEqual(code, 404)
+        self.assertEqual(body, expected.get_data())
+
+    def test_list_products(self):
+        """It should list and filter products like the Flask app"""
+        self._create_products(4)
+        for query in ["", "available=true", "category=tools&max_price=500"]:
+            expected = self.client.get(f"/products?{query}")
+            code, headers, body = call(self.asgi, "/products", query)
+            self.assertEqual(code, 200)
+            self.assertEqual(body, expected.get_data())
+            self.assertEqual(headers["etag"], expected.headers["ETag"])
+
+        code, _, body = call(self.asgi, "/products", "category=TOYS")
+        self.assertEqual(code, 400)
+        self.assertEqual(json.loads(body)["error"], "Bad Request")
+
+    def test_list_products_compressed(self):
+        """It should gzip a large listing like the Flask app"""
+        self._create_products(10)
+        expected = self.client.get("/products")
+        code, headers, body = call(self.asgi, "/products", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(code, 200)
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body), expected.get_data())
+        self.assertEqual(headers["etag"], "W/" + expected.headers["ETag"])
+
+    def test_fallback_to_flask(self):
+        """It should pass other requests on to the Flask app"""
+        self._create_products(3)
+        code, headers, body = call(self.asgi, "/products", "limit=2")
+        self.assertEqual(code, 200)
+        self.assertEqual(len(json.loads(body)), 2)
+        self.assertIn("x-next-cursor", headers)
+
+    def test_sticky_client_skips_cache(self):
+        """It should let Flask answer a client that just wrote"""
+        product = self._create_products(1)[0]
+        product_cache.set(product["id"], ({"id": product["id"], "name": "Cached"}, "v0"))
+        _, _, body = call(self.asgi, f"/products/{product['id']}")
+        self.assertEqual(json.loads(body)["name"], "Cached")
+        _, _, body = call(
+            self.asgi, f"/products/{product['id']}", headers={"Cookie": "read_primary=1"}
+        )
+        self.assertEqual(json.loads(body)["name"], product["name"])
+
+    def test_metrics_and_server_timing(self):
+        """It should record metrics and send Server-Timing like the Flask app"""
+        product = self._create_products(1)[0]
+        product_cache.clear()
+        route = {"route": "/products/<int:product_id>", "method": "GET", "status": "200"}
+        before = sample_value(self.client.get("/metrics").get_data(as_text=True),
+                              "http_requests_total", route) or 0
+        _, headers, _ = call(self.asgi, f"/products/{product['id']}")
+        self.assertEqual(headers["server-timing"].split(";")[-1], 'desc="1 queries"')
+        _, headers, _ = call(self.asgi, "/products")
+        self.assertIn("server-timing", headers)
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertEqual(sample_value(text, "http_requests_total", route), before + 1)
+        self.assertIsNotNone(sample_value(
+            text, "http_requests_total", {"route": "/products", "method": "GET", "status": "200"}
+        ))
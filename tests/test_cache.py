@@ -0,0 +1,69 @@
+"""
+Test cases for the LRU cache
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache
+
+
+class FakeTimer:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+    """Test the LRU cache"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"id": 1})
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.get(3), "three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        """It should not return entries older than the ttl"""
+        self.cache.set(1, "one")
+        self.timer.now = 9
+        self.assertEqual(self.cache.get(1), "one")
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_invalidate_and_clear(self):
+        """It should remove one or all entries"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1)
+        self.cache.invalidate(99)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_disabled(self):
+        """It should not cache anything when maxsize is 0"""
+        self.cache.configure(0, 10)
+        self.cache.set(1, "one")
+        self.assertIsNone(self.cache.get(1))
@@ -5,7 +5,7 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import db_create, db_indexes, db_init
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +21,27 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.Product')
+    @patch('service.common.cli_commands.db')
+    def test_db_indexes(self, db_mock, product_mock):
+        """It should create every missing index"""
+        index = MagicMock()
+        product_mock.missing_indexes.return_value = [index]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_indexes)
+            self.assertEqual(result.exit_code, 0)
+        index.create.assert_called_once_with(db_mock.engine)
+
+    @patch('service.common.cli_commands.Product')
+    @patch('service.common.cli_commands.db')
+    def test_db_init(self, db_mock, product_mock):
+        """It should create the tables and indexes without dropping anything"""
+        product_mock.missing_indexes.return_value = []
+        product_mock.missing_columns.return_value = []
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_init)
+            self.assertEqual(result.exit_code, 0)
+        db_mock.create_all.assert_called_once()
+        db_mock.drop_all.assert_not_called()
+        product_mock.create_search_index.assert_called_once()
@@ -0,0 +1,104 @@
+"""
+Test cases for response compression
+"""
+import gzip
+import json
+import zlib
+from unittest import TestCase
+from service import app
+from service.models import db, Product
+from service.common.compression import GzipCompressor, choose_encoding, compress_stream
+from tests.factories import ProductFactory
+
+BASE_URL = "/products"
+
+
+class TestCompressors(TestCase):
+    """Test the compression helpers"""
+
+    def test_choose_encoding(self):
+        """It should pick an accepted encoding or None"""
+        self.assertEqual(choose_encoding("gzip, deflate"), "gzip")
+        self.assertIsNone(choose_encoding("deflate"))
+        self.assertIsNone(choose_encoding(""))
+        self.assertIsNone(choose_encoding("gzip;q=0"))
+
+    def test_compress_stream(self):
+        """It should flush a decodable block for every chunk"""
+        chunks = compress_stream(iter(["[1", ",2", "]"]), GzipCompressor(6))
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decoder.decompress(next(chunks)), b"[1")
+        self.assertEqual(decoder.decompress(next(chunks)), b",2")
+        body = b"".join(decoder.decompress(chunk) for chunk in chunks)
+        self.assertEqual(body, b"]")
+
+
+class TestCompressedResponses(TestCase):
+    """Test compression of the API responses"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config["TESTING"] = True
+        cls.min_size = app.config["COMPRESS_MIN_SIZE"]
+        app.config["COMPRESS_MIN_SIZE"] = 500
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config["COMPRESS_MIN_SIZE"] = cls.min_size
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        self.client = app.test_client()
+        db.drop_all()
+        db.create_all()
+        for _ in range(10):
+            ProductFactory().create()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_large_response_compressed(self):
+        """It should gzip a body above the threshold"""
+        plain = self.client.get(BASE_URL)
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.get_json())
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertTrue(response.headers["ETag"].startswith('W/'))
+
+        # the weak ETag still revalidates
+        response = self.client.get(
+            BASE_URL, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)  # HTTP_304_NOT_MODIFIED
+
+    def test_small_response_not_compressed(self):
+        """It should send a body below the threshold as it is"""
+        product = Product.all()[0]
+        response = self.client.get(f"{BASE_URL}/{product.id}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json()["id"], product.id)
+
+    def test_not_accepted(self):
+        """It should not compress for clients that do not accept it"""
+        response = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(len(response.get_json()), 10)
+
+    def test_stream_compressed(self):
+        """It should compress a streamed listing incrementally"""
+        response = self.client.get(
+            f"{BASE_URL}?stream=true", headers={"Accept-Encoding": "gzip"}, buffered=False
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        chunks = list(response.response)
+        self.assertGreater(len(chunks), 1)
+        body = json.loads(gzip.decompress(b"".join(chunks)))
+        self.assertEqual(len(body), 10)
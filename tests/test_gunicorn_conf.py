@@ -0,0 +1,57 @@
+"""
+Test cases for the gunicorn configuration
+"""
+import os
+import importlib.util
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**env):
+    """Loads gunicorn.conf.py with the given environment variables"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONFIG_FILE)
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, env):
+        spec.loader.exec_module(module)
+    return module
+
+
+class TestGunicornConfig(TestCase):
+    """Test the gunicorn settings and hooks"""
+
+    @patch("multiprocessing.cpu_count", return_value=4)
+    def test_defaults(self, _cpu_count):
+        """It should size the workers from the CPU count and preload the app"""
+        config = load_config()
+        self.assertEqual(config.workers, 9)
+        self.assertGreater(config.threads, 1)
+        self.assertTrue(config.preload_app)
+        self.assertGreater(config.keepalive, 0)
+        self.assertGreater(config.max_requests, 0)
+        self.assertGreater(config.max_requests_jitter, 0)
+
+    def test_overrides(self):
+        """It should take every setting from the environment"""
+        config = load_config(
+            PORT="9000", GUNICORN_WORKERS="3", GUNICORN_THREADS="1",
+            GUNICORN_PRELOAD="false", GUNICORN_MAX_REQUESTS="0",
+        )
+        self.assertEqual(config.bind, "0.0.0.0:9000")
+        self.assertEqual(config.workers, 3)
+        self.assertEqual(config.threads, 1)
+        self.assertFalse(config.preload_app)
+        self.assertEqual(config.max_requests, 0)
+
+    @patch("service.models.db")
+    def test_post_fork(self, db_mock):
+        """It should dispose of the inherited engine without closing its connections"""
+        load_config().post_fork(MagicMock(), MagicMock())
+        db_mock.engine.dispose.assert_called_once_with(close=False)
+
+    @patch("service.common.metrics.mark_process_dead")
+    def test_child_exit(self, mark_mock):
+        """It should drop the metrics of an exited worker"""
+        load_config().child_exit(MagicMock(), MagicMock(pid=123))
+        mark_mock.assert_called_once_with(123)
@@ -0,0 +1,152 @@
+"""
+Test cases for Idempotency-Key handling of POST /products
+"""
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy.exc import IntegrityError
+from service import app
+from service.models import db, Product, IdempotencyKey
+from service.common import idempotency
+from tests.factories import ProductFactory
+
+BASE_URL = "/products"
+
+
+class TestIdempotentCreate(TestCase):
+    """Test retries of POST /products with an Idempotency-Key"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config["TESTING"] = True
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        self.client = app.test_client()
+        db.drop_all()
+        db.create_all()
+        self.product = ProductFactory().serialize()
+        self.product.pop("id", None)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def post(self, key, data=None):
+        """Posts a product with an Idempotency-Key"""
+        return self.client.post(
+            BASE_URL, json=data or self.product, headers={"Idempotency-Key": key}
+        )
+
+    def claim(self, key, data=None):
+        """Claims a key as if a request with it were running"""
+        with app.test_request_context(BASE_URL, method="POST", json=data or self.product):
+            digest = idempotency.fingerprint()
+        self.assertIsNone(IdempotencyKey.claim(key, digest, 60))
+
+    def test_retry_is_replayed(self):
+        """It should create the product once and replay the response to retries"""
+        first = self.post("abc")
+        self.assertEqual(first.status_code, 201)  # HTTP_201_CREATED
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        with patch.object(Product, "create") as create:
+            retry = self.post("abc")
+            create.assert_not_called()
+        self.assertEqual(retry.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(Product.query.count(), 1)
+
+        response = self.post("xyz")
+        self.assertEqual(response.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(Product.query.count(), 2)
+
+    def test_without_key(self):
+        """It should create a product for every request without a key"""
+        self.client.post(BASE_URL, json=self.product)
+        self.client.post(BASE_URL, json=self.product)
+        self.assertEqual(Product.query.count(), 2)
+        self.assertEqual(IdempotencyKey.query.count(), 0)
+
+    def test_key_reused_for_another_body(self):
+        """It should reject a key sent again with a different product"""
+        self.post("abc")
+        response = self.post("abc", dict(self.product, name="Other"))
+        self.assertEqual(response.status_code, 422)  # HTTP_422_UNPROCESSABLE_ENTITY
+        self.assertEqual(Product.query.count(), 1)
+
+    def test_bad_key(self):
+        """It should reject an empty or overlong key"""
+        self.assertEqual(self.post("").status_code, 400)  # HTTP_400_BAD_REQUEST
+        self.assertEqual(self.post("k" * 256).status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_failed_request_is_not_stored(self):
+        """It should let a retry run again after the first request failed"""
+        response = self.post("abc", dict(self.product, category="Nope"))
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        self.assertEqual(IdempotencyKey.query.count(), 0)
+        self.assertEqual(self.post("abc").status_code, 201)  # HTTP_201_CREATED
+
+    def test_duplicate_waits_for_first_request(self):
+        """It should wait for the request in flight and replay its response"""
+        self.claim("abc")
+
+        def first_request_answers(_seconds):
+            IdempotencyKey.complete("abc", 201, '{"id": 7}', 60)
+
+        with patch.object(idempotency.time, "sleep", side_effect=first_request_answers) as sleep:
+            response = self.post("abc")
+        sleep.assert_called_once()
+        self.assertEqual(response.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(response.get_json(), {"id": 7})
+        self.assertEqual(Product.query.count(), 0)
+
+    def test_duplicate_runs_after_first_request_failed(self):
+        """It should run the request if the one in flight gives up the key"""
+        self.claim("abc")
+        with patch.object(
+            idempotency.time, "sleep", side_effect=lambda _: IdempotencyKey.release("abc")
+        ):
+            response = self.post("abc")
+        self.assertEqual(response.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(Product.query.count(), 1)
+
+    def test_duplicate_gives_up_waiting(self):
+        """It should answer 409 when the request in flight takes too long"""
+        self.claim("abc")
+        wait = app.config["IDEMPOTENCY_WAIT"]
+        app.config["IDEMPOTENCY_WAIT"] = 0
+        self.addCleanup(app.config.__setitem__, "IDEMPOTENCY_WAIT", wait)
+        response = self.post("abc")
+        self.assertEqual(response.status_code, 409)  # HTTP_409_CONFLICT
+        self.assertEqual(Product.query.count(), 0)
+
+    def test_key_changes_hands_while_claiming(self):
+        """It should keep waiting when every attempt to claim a key is raced"""
+        race = IntegrityError("INSERT", {}, Exception("duplicate key"))
+        wait = app.config["IDEMPOTENCY_WAIT"]
+        app.config["IDEMPOTENCY_WAIT"] = 0
+        self.addCleanup(app.config.__setitem__, "IDEMPOTENCY_WAIT", wait)
+        with patch.object(db.session, "execute", side_effect=race):
+            record = IdempotencyKey.claim("abc", "digest", 60)
+            self.assertIsNotNone(record)
+            self.assertEqual(record.fingerprint, "digest")
+            self.assertIsNone(record.status)
+            response = self.post("abc")
+        self.assertEqual(response.status_code, 409)  # HTTP_409_CONFLICT
+        self.assertEqual(Product.query.count(), 0)
+
+    def test_expired_keys(self):
+        """It should run a request again once its key expired and purge old keys"""
+        self.post("abc")
+        IdempotencyKey.query.update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(self.post("abc").status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(Product.query.count(), 2)
+
+        IdempotencyKey.query.update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        self.assertEqual(IdempotencyKey.purge(), 1)
+        self.assertEqual(IdempotencyKey.query.count(), 0)
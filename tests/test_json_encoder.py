@@ -0,0 +1,89 @@
+"""
+Test cases for the JSON encoder
+"""
+import json
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch
+import orjson
+from flask import json as flask_json
+from flask.json import JSONEncoder
+from service import app
+from service.models import db, Category
+from service.common.json_encoder import FastJSONEncoder
+from tests.factories import ProductFactory
+
+
+class TestFastJSONEncoder(TestCase):
+    """Test the JSON encoder against the standard library encoder"""
+
+    def assert_same(self, data, **kwargs):
+        """Checks that both encoders write the same text"""
+        expected = json.dumps(data, cls=JSONEncoder, **kwargs)
+        self.assertEqual(json.dumps(data, cls=FastJSONEncoder, **kwargs), expected)
+
+    def test_compact_output(self):
+        """It should write what jsonify writes today"""
+        product = {
+            "id": 1, "name": "Hat", "description": "A red hat", "price": "12.50",
+            "available": True, "category": "CLOTHS",
+        }
+        for kwargs in [
+            {"separators": (",", ":"), "sort_keys": True},
+            {"separators": (",", ":")},
+            {"indent": 2, "separators": (", ", ": "), "sort_keys": True},
+            {},
+        ]:
+            self.assert_same([product, product], **kwargs)
+            self.assert_same({"status": 404, "error": None, "ratio": 0.25}, **kwargs)
+
+    def test_special_values(self):
+        """It should handle values orjson writes differently"""
+        compact = {"separators": (",", ":"), "sort_keys": True}
+        self.assert_same({"name": "Café ☕"}, **compact)
+        self.assert_same({"name": "Café ☕"}, ensure_ascii=False, **compact)
+        self.assert_same({1: "integer key"}, **compact)
+        self.assert_same({"big": 2 ** 70}, **compact)
+        self.assert_same({"when": datetime(2022, 1, 2, 3, 4, 5)}, **compact)
+        self.assert_same({"price": Decimal("9.99")}, **compact)
+
+    def test_enum_by_name(self):
+        """It should write Enums by name with or without orjson"""
+        for kwargs in [{}, {"separators": (",", ":")}]:
+            data = json.dumps({"category": Category.FOOD}, cls=FastJSONEncoder, **kwargs)
+            self.assertEqual(json.loads(data), {"category": "FOOD"})
+            data = json.dumps([{"tags": [Category.TOOLS]}], cls=FastJSONEncoder, **kwargs)
+            self.assertEqual(json.loads(data), [{"tags": ["TOOLS"]}])
+        with app.app_context():
+            body = flask_json.jsonify({"category": Category.FOOD}).get_data()
+        self.assertEqual(body, b'{"category":"FOOD"}\n')
+
+    def test_installed_in_app(self):
+        """It should be the encoder that jsonify uses"""
+        self.assertIs(app.json_encoder, FastJSONEncoder)
+        with app.app_context():
+            body = flask_json.jsonify({"b": Decimal("1.50"), "a": [1, 2]}).get_data()
+        self.assertEqual(body, b'{"a":[1,2],"b":"1.50"}\n')
+
+    def test_streamed_listing(self):
+        """It should encode the rows of a streamed listing with orjson"""
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        db.drop_all()
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        self.addCleanup(db.session.remove)
+        products = [ProductFactory() for _ in range(3)]
+        for product in products:
+            product.create()
+        with patch.object(orjson, "dumps", wraps=orjson.dumps) as dumps:
+            response = app.test_client().get("/products?stream=true")
+            self.assertEqual(len(response.get_json()), 3)
+        ids = [call.args[0].get("id") for call in dumps.call_args_list]
+        self.assertEqual([i for i in ids if i], [product.id for product in products])
+
+    def test_errors(self):
+        """It should raise TypeError for values it cannot encode"""
+        self.assertRaises(TypeError, json.dumps, {"x": object()}, cls=FastJSONEncoder)
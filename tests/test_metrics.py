@@ -0,0 +1,97 @@
+"""
+Test cases for the request metrics
+"""
+import os
+import sys
+import tempfile
+import subprocess
+from unittest import TestCase
+from service import app
+from service.models import db
+from service.common.metrics import IN_FLIGHT
+from tests.helpers import sample_value
+
+WORKER = """
+from service import app
+from service.models import db
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+client.get("/products")
+client.get("/products/0")
+"""
+
+
+class TestRequestMetrics(TestCase):
+    """Test the request metrics and the /metrics endpoint"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        app.config["TESTING"] = True
+        self.client = app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def scrape(self) -> str:
+        """Returns the text of /metrics"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        return response.get_data(as_text=True)
+
+    def test_counts_by_route_and_status(self):
+        """It should count requests by URL rule, method and status"""
+        route = {"route": "/products/<int:product_id>", "method": "GET"}
+        before = sample_value(self.scrape(), "http_requests_total", {**route, "status": "404"}) or 0
+        self.client.get("/products/1")
+        self.client.get("/products/2")
+        text = self.scrape()
+        self.assertEqual(
+            sample_value(text, "http_requests_total", {**route, "status": "404"}), before + 2
+        )
+        self.assertGreaterEqual(
+            sample_value(text, "http_request_duration_seconds_count", route), before + 2
+        )
+        self.assertIsNotNone(
+            sample_value(text, "http_request_duration_seconds_bucket", {**route, "le": "+Inf"})
+        )
+
+    def test_unmatched_route(self):
+        """It should put URLs that match no route under one label"""
+        self.client.get("/no/such/path/123")
+        text = self.scrape()
+        self.assertIsNotNone(
+            sample_value(text, "http_requests_total", {"route": "<unmatched>", "status": "404"})
+        )
+        self.assertNotIn("/no/such/path", text)
+
+    def test_in_flight(self):
+        """It should count the request being served and release it afterwards"""
+        text = self.scrape()
+        labels = {"route": "/metrics", "method": "GET"}
+        self.assertEqual(sample_value(text, "http_requests_in_progress", labels), 1)
+        self.assertEqual(IN_FLIGHT.labels("/metrics", "GET")._value.get(), 0)
+
+    def test_aggregates_across_processes(self):
+        """It should add up the metrics of every worker process"""
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            env.setdefault("DATABASE_URI", "sqlite:///:memory:")
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", WORKER], env=env, check=True)
+            scrape = subprocess.run(
+                [sys.executable, "-c", "from service.common.metrics import render; "
+                 "print(render()[0].decode())"],
+                env=env, check=True, capture_output=True, text=True,
+            )
+        labels = {"route": "/products/<int:product_id>", "method": "GET", "status": "404"}
+        self.assertEqual(sample_value(scrape.stdout, "http_requests_total", labels), 2)
+        labels = {"route": "/products", "method": "GET"}
+        self.assertEqual(
+            sample_value(scrape.stdout, "http_request_duration_seconds_count", labels), 2
+        )
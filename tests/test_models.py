@@ -1,16 +1,21 @@
 import unittest
-from service.models import db, Product
+from unittest.mock import patch
+from service.models import db, Product, Category, DataValidationError, product_cache
 from service import app
 
 class TestProductModel(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures"""
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
         self.app = app.test_client()
         db.create_all()
+        product_cache.clear()
 
     def tearDown(self):
         """Clean up after each test"""
@@ -182,6 +187,114 @@ class TestProductModel(unittest.TestCase):
         product = Product.find(999)
         self.assertIsNone(product)
 
+    def test_paginate_products(self):
+        """Test paging through products with a keyset cursor"""
+        for i in range(5):
+            db.session.add(
+                Product(name=f"Item {i}", description="An item", price=1,
+                        available=True, category=Category.TOOLS)
+            )
+        db.session.commit()
+
+        products, cursor = Product.paginate(limit=2)
+        self.assertEqual([p.name for p in products], ["Item 0", "Item 1"])
+        products, cursor = Product.paginate(limit=2, cursor=cursor)
+        self.assertEqual([p.name for p in products], ["Item 2", "Item 3"])
+        products, cursor = Product.paginate(limit=2, cursor=cursor)
+        self.assertEqual([p.name for p in products], ["Item 4"])
+        self.assertIsNone(cursor)
+
+    def test_bulk_create_in_chunks(self):
+        """Test bulk creating products in several chunks"""
+        items = [
+            {"name": f"Item {i}", "description": "An item", "price": "1.50",
+             "available": True, "category": "FOOD"}
+            for i in range(5)
+        ]
+        items.append({"name": "Broken"})
+        created, failures = Product.bulk_create(items, chunk_size=2)
+        self.assertEqual(created, 5)
+        self.assertEqual([index for index, _ in failures], [5])
+        self.assertEqual(len(Product.all()), 5)
+
+    def test_bulk_create_rejected_row(self):
+        """Test that a row the database rejects fails alone"""
+        items = [
+            {"name": f"Item {i}", "description": "An item", "price": "1.50",
+             "available": True, "category": "FOOD"}
+            for i in range(5)
+        ]
+        to_mapping = Product.to_mapping
+
+        def null_name(product):
+            mapping = to_mapping(product)
+            if product.name == "Item 2":
+                mapping["name"] = None
+            return mapping
+
+        with patch.object(Product, "to_mapping", autospec=True, side_effect=null_name):
+            created, failures = Product.bulk_create(items, chunk_size=5)
+        self.assertEqual(created, 4)
+        self.assertEqual([index for index, _ in failures], [2])
+        self.assertEqual(len(Product.all()), 4)
+
+    def test_deserialize_bad_types(self):
+        """Test that names, descriptions and prices of the wrong type are rejected"""
+        data = {"name": "Hat", "description": "A hat", "price": "1.50",
+                "available": True, "category": "FOOD"}
+        for key, value in [("name", None), ("description", 5), ("price", [1])]:
+            self.assertRaises(
+                DataValidationError, Product().deserialize, dict(data, **{key: value})
+            )
+
+    def test_find_by_filters(self):
+        """Test finding products by several criteria at once"""
+        for name, price, available, category in [
+            ("Apple", 1, True, Category.FOOD),
+            ("Bread", 3, False, Category.FOOD),
+            ("Hammer", 20, True, Category.TOOLS),
+        ]:
+            db.session.add(
+                Product(name=name, description="An item", price=price,
+                        available=available, category=category)
+            )
+        db.session.commit()
+
+        products = Product.find_by_filters(category="food", available=True).all()
+        self.assertEqual([p.name for p in products], ["Apple"])
+        products = Product.find_by_filters(min_price="2", max_price=20).all()
+        self.assertEqual([p.name for p in products], ["Bread", "Hammer"])
+        self.assertEqual(Product.find_by_filters().count(), 3)
+        self.assertRaises(DataValidationError, Product.find_by_filters, category="TOYS")
+
+    def test_missing_indexes(self):
+        """Test detecting indexes that were dropped from the table"""
+        self.assertEqual(Product.missing_indexes(), [])
+        db.session.execute("DROP INDEX ix_product_name")
+        db.session.commit()
+        missing = Product.missing_indexes()
+        self.assertEqual([index.name for index in missing], ["ix_product_name"])
+
+    def test_serialize_rows(self):
+        """Test serializing from column tuples matches serialize()"""
+        for i in range(3):
+            db.session.add(
+                Product(name=f"Item {i}", description="An item", price="10.50",
+                        available=bool(i % 2), category=Category.HOUSEWARES)
+            )
+        db.session.commit()
+        expected = [product.serialize() for product in Product.query.order_by(Product.id)]
+        actual = list(Product.serialize_rows(Product.query.order_by(Product.id)))
+        self.assertEqual(actual, expected)
+        streamed = list(Product.stream(batch_size=2, serialized=True))
+        self.assertEqual(streamed, expected)
+
+    def test_paginate_bad_cursor(self):
+        """Test paging with a cursor that cannot be decoded"""
+        self.assertRaises(DataValidationError, Product.paginate, None, 2, "!!!")
+        bad_cursor = Product.encode_cursor("abc")
+        self.assertRaises(DataValidationError, Product.paginate, None, 2, bad_cursor)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,51 @@
+"""
+Test cases for the timed connection pool
+"""
+import sqlite3
+from unittest import TestCase
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import StaticPool
+from service.common.pool import TimedQueuePool, pool_stats
+
+
+class TestTimedQueuePool(TestCase):
+    """Test the timed connection pool"""
+
+    def setUp(self):
+        self.pool = TimedQueuePool(
+            lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=1, timeout=0.05
+        )
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_pool_stats(self):
+        """It should report checked out, idle and overflow connections"""
+        first = self.pool.connect()
+        second = self.pool.connect()
+        stats = pool_stats(self.pool)
+        self.assertEqual(stats["pool"], "TimedQueuePool")
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        first.close()
+        second.close()
+        stats = pool_stats(self.pool)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_pool_timeout(self):
+        """It should count checkouts that time out and how long they waited"""
+        connections = [self.pool.connect(), self.pool.connect()]
+        self.assertRaises(PoolTimeoutError, self.pool.connect)
+        stats = pool_stats(self.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.05)
+        for connection in connections:
+            connection.close()
+
+    def test_other_pools(self):
+        """It should only name pools that have no queue"""
+        pool = StaticPool(lambda: sqlite3.connect(":memory:"))
+        self.assertEqual(pool_stats(pool), {"pool": "StaticPool"})
@@ -0,0 +1,197 @@
+"""
+Test cases for the read replica routing
+"""
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from service import app
+from service.models import db, Product, product_cache
+from service.common.replicas import ReplicaSet, replicas
+from tests.factories import ProductFactory
+
+BAD_URI = "sqlite:////nonexistent/directory/replica.db"
+
+
+class FakeTimer:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReplicaSet(TestCase):
+    """Test choosing replicas and checking their health"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.replicas = ReplicaSet(timer=self.timer)
+
+    def tearDown(self):
+        self.replicas.dispose()
+
+    def test_no_replicas(self):
+        """It should use the primary without replicas"""
+        self.assertIsNone(self.replicas.choose())
+
+    def test_round_robin(self):
+        """It should take turns between the healthy replicas"""
+        self.replicas.configure(["sqlite://", "sqlite://"], check_interval=60)
+        first, second = self.replicas.engines
+        self.assertEqual(
+            [self.replicas.choose() for _ in range(4)], [first, second, first, second]
+        )
+        self.replicas.mark_down(first)
+        self.assertEqual([self.replicas.choose() for _ in range(2)], [second, second])
+        self.replicas.mark_down(second)
+        self.assertIsNone(self.replicas.choose())
+
+    def wait_for_check(self):
+        """Waits for the background health check, if one is running"""
+        thread = self.replicas.check_thread
+        if thread is not None:
+            thread.join()
+
+    def test_health_check(self):
+        """It should take a failing replica out and put it back once it recovers"""
+        self.replicas.configure(["sqlite://", BAD_URI], check_interval=10)
+        good, _ = self.replicas.engines
+        self.timer.now = 10
+        self.replicas.choose()
+        self.wait_for_check()
+        self.assertEqual([self.replicas.choose() for _ in range(2)], [good, good])
+        self.assertEqual(
+            [replica["healthy"] for replica in self.replicas.stats()["replicas"]], [True, False]
+        )
+        self.replicas.engines[1] = create_engine("sqlite://")
+        self.timer.now = 15
+        self.assertEqual(self.replicas.choose(), good)  # not checked again yet
+        self.timer.now = 20
+        self.replicas.choose()
+        self.wait_for_check()
+        self.assertEqual(len({self.replicas.choose() for _ in range(2)}), 2)
+
+    def test_health_check_in_background(self):
+        """It should not hold up requests while a health check runs"""
+        self.replicas.configure(["sqlite://"], check_interval=10)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with patch.object(self.replicas, "check", side_effect=lambda: release.wait(5)) as check:
+            self.timer.now = 10
+            self.assertIsNotNone(self.replicas.choose())
+            self.timer.now = 25
+            self.assertIsNotNone(self.replicas.choose())
+            release.set()
+            self.wait_for_check()
+        check.assert_called_once()
+
+    def test_connect_timeout(self):
+        """It should bound how long the network drivers wait to connect"""
+        # pylint: disable=protected-access
+        options = ReplicaSet._with_timeout(
+            "postgresql://user@replica/db", {"connect_args": {"sslmode": "require"}}, 3
+        )
+        self.assertEqual(options["connect_args"], {"sslmode": "require", "connect_timeout": 3})
+        self.assertEqual(ReplicaSet._with_timeout("sqlite://", {}, 3), {})
+
+
+class TestReplicaRouting(TestCase):
+    """Test which database the requests read from"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        app.config["TESTING"] = True
+        self.client = app.test_client()
+        db.drop_all()
+        db.create_all()
+        product_cache.clear()
+        handle, self.replica_file = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        replica_uri = f"sqlite:///{self.replica_file}"
+        replicas.configure([replica_uri], check_interval=60)
+        Product.__table__.create(replicas.engines[0])
+        with replicas.engines[0].begin() as connection:
+            connection.execute(Product.__table__.insert(), {
+                "name": "ReplicaOnly", "description": "On the replica", "price": 1,
+                "available": True, "category": "FOOD",
+            })
+
+    def tearDown(self):
+        replicas.configure([])
+        db.session.remove()
+        db.drop_all()
+        os.unlink(self.replica_file)
+
+    def names(self) -> list:
+        """Returns the names that GET /products lists"""
+        response = self.client.get("/products")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        return [product["name"] for product in response.get_json()]
+
+    def test_reads_from_replica(self):
+        """It should read from the replica and write to the primary"""
+        self.assertEqual(self.names(), ["ReplicaOnly"])
+        product = ProductFactory().serialize()
+        response = self.client.post("/products", json=product)
+        self.assertEqual(response.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(Product.query.count(), 1)
+        self.assertIn("read_primary=1", response.headers["Set-Cookie"])
+
+        # the client that wrote reads its write from the primary
+        self.assertEqual(self.names(), [product["name"]])
+
+        # other clients keep reading from the replica
+        self.client.delete_cookie("localhost", "read_primary")
+        self.assertEqual(self.names(), ["ReplicaOnly"])
+
+    def test_write_request_reads_primary(self):
+        """It should read from the primary inside a write request"""
+        created = self.client.post("/products", json=ProductFactory().serialize()).get_json()
+        self.client.delete_cookie("localhost", "read_primary")
+        created["description"] = "Updated"
+        response = self.client.put(f"/products/{created['id']}", json=created)
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json()["description"], "Updated")
+
+    def test_replica_reads_not_cached(self):
+        """It should not cache what a lagging replica returns"""
+        product = ProductFactory().serialize()
+        created = self.client.post("/products", json=product).get_json()
+        created["name"] = "New"
+        response = self.client.put(f"/products/{created['id']}", json=created)
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+
+        # another client reads the stale row from the replica
+        other = app.test_client()
+        response = other.get(f"/products/{created['id']}")
+        self.assertEqual(response.get_json()["name"], "ReplicaOnly")
+        self.assertIsNone(product_cache.get(created["id"]))
+
+        # the client that wrote still reads its write
+        response = self.client.get(f"/products/{created['id']}")
+        self.assertEqual(response.get_json()["name"], "New")
+        self.assertEqual(response.headers["ETag"], '"v2"')
+
+    def test_writer_skips_cache(self):
+        """It should not answer a client that just wrote from the cache"""
+        created = self.client.post("/products", json=ProductFactory().serialize()).get_json()
+        product_cache.set(created["id"], ({"id": created["id"], "name": "Cached"}, "v0"))
+        response = self.client.get(f"/products/{created['id']}")
+        self.assertEqual(response.get_json()["name"], created["name"])
+
+    def test_failed_replica_out_of_rotation(self):
+        """It should read from the primary when the replica fails its health check"""
+        replicas.configure([BAD_URI], check_interval=60)
+        replicas.check()
+        self.client.post("/products", json=ProductFactory().serialize())
+        self.client.delete_cookie("localhost", "read_primary")
+        self.assertEqual(len(self.names()), 1)
+        response = self.client.get("/metrics/replicas")
+        self.assertFalse(response.get_json()["replicas"][0]["healthy"])
@@ -1,6 +1,10 @@
+import json
 import unittest
+from decimal import Decimal
+from unittest.mock import patch
+from sqlalchemy import event
 from service import app
-from service.models import db, Product
+from service.models import db, Product, Category, product_cache, product_names, stats_cache
 from tests.factories import ProductFactory
 
 BASE_URL = "/products"
@@ -9,11 +13,17 @@ class TestProductRoutes(unittest.TestCase):
 
     def setUp(self):
         """Set up test fixtures"""
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         self.app = app.test_client()
         db.drop_all()
         db.create_all()
+        product_cache.clear()
+        product_names.invalidate()
+        stats_cache.clear()
 
     def _create_products(self, count=1):
         """Helper method to create products"""
@@ -126,6 +136,634 @@ class TestProductRoutes(unittest.TestCase):
         products = response.get_json()
         self.assertEqual(len(products), 1)  # Only 1 product should not be available
 
+    def test_list_products_paginated(self):
+        """Test paging through products with limit and cursor"""
+        created = self._create_products(5)
+        response = self.app.get(f"{BASE_URL}?limit=2")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        page = response.get_json()
+        self.assertEqual([p["id"] for p in page], [p["id"] for p in created[:2]])
+        cursor = response.headers.get("X-Next-Cursor")
+        self.assertIsNotNone(cursor)
+
+        seen = [p["id"] for p in page]
+        while cursor:
+            response = self.app.get(f"{BASE_URL}?limit=2&cursor={cursor}")
+            self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+            seen.extend(p["id"] for p in response.get_json())
+            cursor = response.headers.get("X-Next-Cursor")
+        self.assertEqual(seen, [p["id"] for p in created])
+
+    def test_list_products_bad_pagination(self):
+        """Test paging with an invalid limit or cursor"""
+        response = self.app.get(f"{BASE_URL}?limit=0")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}?limit=abc")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}?limit=2&cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_list_products_ndjson(self):
+        """Test streaming products as newline delimited JSON"""
+        created = self._create_products(3)
+        response = self.app.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], created)
+
+    def test_list_products_streamed_array(self):
+        """Test streaming products as a JSON array"""
+        response = self.app.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), [])
+        created = self._create_products(3)
+        response = self.app.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), created)
+
+    def test_bulk_create_products(self):
+        """Test creating many products from a JSON array"""
+        products = [ProductFactory().serialize() for _ in range(5)]
+        response = self.app.post(f"{BASE_URL}/bulk", json=products)
+        self.assertEqual(response.status_code, 201)  # HTTP_201_CREATED
+        self.assertEqual(response.get_json(), {"created": 5, "failed": []})
+        response = self.app.get(BASE_URL)
+        self.assertEqual(len(response.get_json()), 5)
+
+    def test_bulk_create_products_ndjson(self):
+        """Test creating many products from an NDJSON stream"""
+        products = [ProductFactory().serialize() for _ in range(3)]
+        lines = [json.dumps(product) for product in products]
+        lines.insert(1, "{not json")
+        response = self.app.post(
+            f"{BASE_URL}/bulk",
+            data="\n".join(lines) + "\n",
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, 207)  # HTTP_207_MULTI_STATUS
+        data = response.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual([item["index"] for item in data["failed"]], [1])
+
+    def test_bulk_create_products_partial_failure(self):
+        """Test bulk create reports invalid items by position"""
+        products = [ProductFactory().serialize() for _ in range(3)]
+        del products[0]["name"]
+        products[2]["price"] = "free"
+        response = self.app.post(f"{BASE_URL}/bulk", json=products)
+        self.assertEqual(response.status_code, 207)  # HTTP_207_MULTI_STATUS
+        data = response.get_json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual([item["index"] for item in data["failed"]], [0, 2])
+
+    def test_bulk_create_products_bad_types(self):
+        """Test bulk create fails only the items with a null name or a bad price"""
+        products = [ProductFactory().serialize() for _ in range(5)]
+        products[1]["name"] = None
+        products[3]["price"] = [1]
+        response = self.app.post(f"{BASE_URL}/bulk", json=products)
+        self.assertEqual(response.status_code, 207)  # HTTP_207_MULTI_STATUS
+        data = response.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual([item["index"] for item in data["failed"]], [1, 3])
+        response = self.app.post(BASE_URL, json=products[3])
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_bulk_create_products_not_a_list(self):
+        """Test bulk create with a body that is not an array"""
+        response = self.app.post(f"{BASE_URL}/bulk", json={"name": "Hat"})
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_bulk_update_products_by_filter(self):
+        """Test marking every product of a category unavailable"""
+        products = [ProductFactory(category=Category.FOOD, available=True) for _ in range(3)]
+        products.append(ProductFactory(category=Category.TOOLS, available=True))
+        self.app.post(f"{BASE_URL}/bulk", json=[p.serialize() for p in products])
+
+        response = self.app.patch(
+            f"{BASE_URL}/bulk?category=FOOD", json={"set": {"available": False}}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), {"updated": 3})
+        response = self.app.get(f"{BASE_URL}?available=true")
+        self.assertEqual([p["category"] for p in response.get_json()], ["TOOLS"])
+
+    def test_bulk_update_products_by_ids(self):
+        """Test repricing a list of products"""
+        created = self._create_products(3)
+        ids = [created[0]["id"], created[2]["id"]]
+        response = self.app.patch(
+            f"{BASE_URL}/bulk", json={"ids": ids, "set": {"price": "9.99"}}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), {"updated": 2})
+        for product_id in ids:
+            response = self.app.get(f"{BASE_URL}/{product_id}")
+            self.assertEqual(Decimal(response.get_json()["price"]), Decimal("9.99"))
+
+    def test_bulk_update_products_bad_request(self):
+        """Test bulk update without a target or with bad values"""
+        response = self.app.patch(f"{BASE_URL}/bulk", json={"set": {"available": False}})
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.patch(f"{BASE_URL}/bulk", json={"ids": [1]})
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.patch(
+            f"{BASE_URL}/bulk", json={"ids": [1], "set": {"color": "red"}}
+        )
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.patch(
+            f"{BASE_URL}/bulk", json={"ids": "1", "set": {"available": False}}
+        )
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.delete(f"{BASE_URL}/bulk", json={"ids": [True]})
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_bulk_delete_products(self):
+        """Test deleting products by ids and by filter"""
+        created = self._create_products(4)
+        response = self.app.delete(f"{BASE_URL}/bulk", json={"ids": [created[0]["id"]]})
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), {"deleted": 1})
+
+        remaining = len([p for p in created[1:] if p["available"]])
+        response = self.app.delete(f"{BASE_URL}/bulk?available=true")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), {"deleted": remaining})
+
+        response = self.app.delete(f"{BASE_URL}/bulk")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_bulk_requests_with_empty_filters(self):
+        """Test that empty filter values or ids never select the whole table"""
+        self._create_products(3)
+        response = self.app.delete(f"{BASE_URL}/bulk?name=")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.delete(f"{BASE_URL}/bulk?available=true&category=")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.delete(f"{BASE_URL}/bulk", json={"ids": []})
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.patch(
+            f"{BASE_URL}/bulk?category=", json={"set": {"available": False}}
+        )
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(BASE_URL)
+        self.assertEqual(len(response.get_json()), 3)
+
+    def test_filter_products_combined(self):
+        """Test combining category, availability and price filters"""
+        products = [
+            ProductFactory(category=Category.FOOD, available=True, price=Decimal("5.00")),
+            ProductFactory(category=Category.FOOD, available=True, price=Decimal("50.00")),
+            ProductFactory(category=Category.FOOD, available=False, price=Decimal("5.00")),
+            ProductFactory(category=Category.TOOLS, available=True, price=Decimal("5.00")),
+        ]
+        for product in products:
+            self.app.post(BASE_URL, json=product.serialize())
+
+        response = self.app.get(f"{BASE_URL}?category=food&available=true")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(len(response.get_json()), 2)
+        response = self.app.get(f"{BASE_URL}?category=FOOD&available=true&max_price=10")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(len(response.get_json()), 1)
+        response = self.app.get(f"{BASE_URL}?min_price=10&max_price=100")
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_filter_products_bad_values(self):
+        """Test filtering with an unknown category or bad price"""
+        response = self.app.get(f"{BASE_URL}?category=TOYS")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}?min_price=cheap")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_get_product_cached(self):
+        """Test a repeated lookup is served from the cache"""
+        product = self._create_products(1)[0]
+        self.app.get(f"{BASE_URL}/{product['id']}")
+        hits = product_cache.stats()["hits"]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(product_cache.stats()["hits"], hits + 1)
+
+        response = self.app.get("/metrics/cache")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json()["hits"], hits + 1)
+
+    def test_get_product_cache_invalidated(self):
+        """Test writes invalidate the cached product"""
+        product = self._create_products(1)[0]
+        self.app.get(f"{BASE_URL}/{product['id']}")
+        product["name"] = "Renamed"
+        response = self.app.put(f"{BASE_URL}/{product['id']}", json=product)
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.get_json()["name"], "Renamed")
+
+        self.app.patch(
+            f"{BASE_URL}/bulk", json={"ids": [product["id"]], "set": {"name": "Bulk"}}
+        )
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.get_json()["name"], "Bulk")
+
+        self.app.delete(f"{BASE_URL}/{product['id']}")
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.status_code, 404)  # HTTP_404_NOT_FOUND
+
+    def test_get_product_not_modified(self):
+        """Test a conditional GET of an unchanged product"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        etag = response.headers["ETag"]
+        response = self.app.get(
+            f"{BASE_URL}/{product['id']}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)  # HTTP_304_NOT_MODIFIED
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        product["name"] = "Changed"
+        self.app.put(f"{BASE_URL}/{product['id']}", json=product)
+        response = self.app.get(
+            f"{BASE_URL}/{product['id']}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_list_products_not_modified(self):
+        """Test a conditional GET of an unchanged listing"""
+        self._create_products(2)
+        response = self.app.get(BASE_URL)
+        etag = response.headers["ETag"]
+        response = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)  # HTTP_304_NOT_MODIFIED
+        self._create_products(1)
+        response = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(len(response.get_json()), 3)
+
+    def test_pool_metrics(self):
+        """Test the connection pool metrics endpoint"""
+        response = self.app.get("/metrics/pool")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertIn("pool", response.get_json())
+
+    def test_search_products(self):
+        """Test full-text search ranks and pages the matches"""
+        products = [
+            {"name": "Red Hat", "description": "A red fedora hat", "price": "10.00",
+             "available": True, "category": "CLOTHS"},
+            {"name": "Blue Hat", "description": "A blue cap", "price": "12.00",
+             "available": True, "category": "CLOTHS"},
+            {"name": "Red Shoes", "description": "Running shoes", "price": "50.00",
+             "available": True, "category": "CLOTHS"},
+        ]
+        created = [self.app.post(BASE_URL, json=product).get_json() for product in products]
+
+        response = self.app.get(f"{BASE_URL}/search?q=red+hat")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual([p["name"] for p in response.get_json()], ["Red Hat"])
+
+        response = self.app.get(f"{BASE_URL}/search?q=hat&limit=1")
+        self.assertEqual(response.get_json()[0]["name"], "Red Hat")
+        cursor = response.headers["X-Next-Cursor"]
+        response = self.app.get(f"{BASE_URL}/search?q=hat&limit=1&cursor={cursor}")
+        self.assertEqual([p["name"] for p in response.get_json()], ["Blue Hat"])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+        self.app.put(
+            f"{BASE_URL}/{created[1]['id']}", json=dict(products[1], name="Blue Beret")
+        )
+        self.app.delete(f"{BASE_URL}/{created[0]['id']}")
+        response = self.app.get(f"{BASE_URL}/search?q=hat")
+        self.assertEqual(response.get_json(), [])
+        response = self.app.get(f"{BASE_URL}/search?q=beret")
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_search_products_bad_request(self):
+        """Test search without any words"""
+        response = self.app.get(f"{BASE_URL}/search")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}/search?q=%22%2A")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_suggest_products(self):
+        """Test type-ahead suggestions follow creates, updates and deletes"""
+        for name in ["Hammer", "hand saw", "Hat", "Hat", "Shovel"]:
+            product = ProductFactory(name=name)
+            self.app.post(BASE_URL, json=product.serialize())
+
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=ha")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json(), ["Hammer", "hand saw", "Hat"])
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=HA&limit=2")
+        self.assertEqual(response.get_json(), ["Hammer", "hand saw"])
+
+        hammer = self.app.get(f"{BASE_URL}?name=Hammer").get_json()[0]
+        self.app.put(f"{BASE_URL}/{hammer['id']}", json=dict(hammer, name="Mallet"))
+        self.app.post(BASE_URL, json=ProductFactory(name="Handle").serialize())
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=ha")
+        self.assertEqual(response.get_json(), ["hand saw", "Handle", "Hat"])
+
+        self.app.delete(f"{BASE_URL}/bulk?name=Hat")
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=ha")
+        self.assertEqual(response.get_json(), ["hand saw", "Handle"])
+
+    def test_suggest_products_bad_request(self):
+        """Test suggestions without a prefix"""
+        response = self.app.get(f"{BASE_URL}/suggest")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=a&limit=0")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_product_stats(self):
+        """Test per-category statistics and their invalidation"""
+        for price, available, category in [
+            ("1.00", True, "FOOD"), ("3.00", False, "FOOD"), ("20.00", True, "TOOLS"),
+        ]:
+            self.app.post(BASE_URL, json={
+                "name": "Item", "description": "An item", "price": price,
+                "available": available, "category": category,
+            })
+
+        response = self.app.get(f"{BASE_URL}/stats")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        food, tools = response.get_json()
+        self.assertEqual(food["category"], "FOOD")
+        self.assertEqual(food["count"], 2)
+        self.assertEqual(Decimal(food["min_price"]), Decimal("1.00"))
+        self.assertEqual(food["avg_price"], "2.00")
+        self.assertEqual(Decimal(food["max_price"]), Decimal("3.00"))
+        self.assertEqual(food["available_ratio"], 0.5)
+        self.assertEqual(tools["count"], 1)
+
+        response = self.app.get(f"{BASE_URL}/stats?available=true&max_price=10")
+        self.assertEqual([s["category"] for s in response.get_json()], ["FOOD"])
+
+        self.app.delete(f"{BASE_URL}/bulk?category=TOOLS")
+        response = self.app.get(f"{BASE_URL}/stats")
+        self.assertEqual([s["category"] for s in response.get_json()], ["FOOD"])
+
+        response = self.app.get(f"{BASE_URL}/stats?min_price=abc")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_list_products_sorted(self):
+        """Test sorting and top-N listings"""
+        for name, price, category in [
+            ("Saw", "15.00", "TOOLS"), ("Axe", "30.00", "TOOLS"), ("Drill", "15.00", "TOOLS"),
+            ("Hammer", "9.00", "TOOLS"), ("Bread", "2.00", "FOOD"),
+        ]:
+            self.app.post(BASE_URL, json={
+                "name": name, "description": "An item", "price": price,
+                "available": True, "category": category,
+            })
+
+        response = self.app.get(f"{BASE_URL}?sort=price,-name")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        names = [p["name"] for p in response.get_json()]
+        self.assertEqual(names, ["Bread", "Hammer", "Saw", "Drill", "Axe"])
+
+        response = self.app.get(f"{BASE_URL}?category=TOOLS&available=true&sort=price&limit=2")
+        self.assertEqual([p["name"] for p in response.get_json()], ["Hammer", "Saw"])
+
+        # page through the same order with the cursor
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = self.app.get(f"{BASE_URL}?sort=price,-name&limit=2&cursor={cursor}")
+            seen.extend(p["name"] for p in response.get_json())
+            cursor = response.headers.get("X-Next-Cursor")
+        self.assertEqual(seen, names)
+
+        response = self.app.get(f"{BASE_URL}?sort=-price&stream=true")
+        self.assertEqual(response.get_json()[0]["name"], "Axe")
+
+    def test_list_products_sorted_by_available(self):
+        """Test paging through products sorted by availability"""
+        products = []
+        for available, category in [
+            (True, Category.FOOD), (False, Category.FOOD), (True, Category.FOOD),
+            (False, Category.TOOLS), (True, Category.TOOLS),
+        ]:
+            product = ProductFactory(available=available, category=category)
+            response = self.app.post(BASE_URL, json=product.serialize())
+            products.append(response.get_json())
+        for sort in ["available", "-available", "-category,available"]:
+            seen = []
+            cursor = ""
+            while cursor is not None:
+                response = self.app.get(f"{BASE_URL}?sort={sort}&limit=2&cursor={cursor}")
+                self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+                seen.extend(response.get_json())
+                cursor = response.headers.get("X-Next-Cursor")
+            self.assertEqual(sorted(p["id"] for p in seen), sorted(p["id"] for p in products))
+            available = [p["available"] for p in seen]
+            if sort == "available":
+                self.assertEqual(available, sorted(available))
+            if sort == "-available":
+                self.assertEqual(available, sorted(available, reverse=True))
+
+    def test_list_products_bad_sort(self):
+        """Test sorting by an unknown or repeated field"""
+        response = self.app.get(f"{BASE_URL}?sort=color")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        response = self.app.get(f"{BASE_URL}?sort=price,-price")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+        cursor = Product.encode_cursor("abc", 1)
+        response = self.app.get(f"{BASE_URL}?sort=price&limit=1&cursor={cursor}")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_list_products_fields(self):
+        """Test listing only some fields of the products"""
+        products = self._create_products(3)
+        response = self.app.get(f"{BASE_URL}?fields=price,id")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        data = response.get_json()
+        self.assertEqual(len(data), 3)
+        for item in data:
+            self.assertEqual(set(item), {"id", "price"})
+
+        # paging by a field that was not requested still works
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = self.app.get(f"{BASE_URL}?fields=name&sort=-price&limit=2&cursor={cursor}")
+            data = response.get_json()
+            self.assertTrue(all(set(item) == {"name"} for item in data))
+            seen.extend(item["name"] for item in data)
+            cursor = response.headers.get("X-Next-Cursor")
+        self.assertEqual(sorted(seen), sorted(p["name"] for p in products))
+
+        response = self.app.get(f"{BASE_URL}?fields=id,category&stream=true")
+        self.assertEqual(set(response.get_json()[0]), {"id", "category"})
+
+        response = self.app.get(f"{BASE_URL}?fields=id,color")
+        self.assertEqual(response.status_code, 400)  # HTTP_400_BAD_REQUEST
+
+    def test_get_product_fields(self):
+        """Test reading only some fields of a product"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        full_etag = response.headers["ETag"]
+        response = self.app.get(f"{BASE_URL}/{product['id']}?fields=name,available")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(
+            response.get_json(), {"name": product["name"], "available": product["available"]}
+        )
+        self.assertNotEqual(response.headers["ETag"], full_etag)
+        response = self.app.get(
+            f"{BASE_URL}/{product['id']}?fields=name,available",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        self.assertEqual(response.status_code, 304)  # HTTP_304_NOT_MODIFIED
+
+    def test_update_product_if_match(self):
+        """Test updating a product only at the version the client has"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, '"v1"')
+
+        product["description"] = "First edit"
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        self.assertEqual(response.get_json()["description"], "First edit")
+        self.assertEqual(response.headers["ETag"], '"v2"')
+
+        # a second editor working from the first version is rejected
+        product["description"] = "Lost edit"
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 412)  # HTTP_412_PRECONDITION_FAILED
+        self.assertEqual(response.get_json()["error"], "Precondition Failed")
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.get_json()["description"], "First edit")
+
+        # weak ETags from compressed responses match too
+        product["description"] = "Second edit"
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": 'W/"v2"'}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+
+        response = self.app.put(f"{BASE_URL}/0", json=product, headers={"If-Match": '"v1"'})
+        self.assertEqual(response.status_code, 404)  # HTTP_404_NOT_FOUND
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": '"abc"'}
+        )
+        self.assertEqual(response.status_code, 412)  # HTTP_412_PRECONDITION_FAILED
+
+    def test_update_product_changed_by_another_worker(self):
+        """Test that a 412 drops the cached copy of the product"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.headers["ETag"], '"v1"')
+        # another worker writes the product, leaving this cache stale
+        db.session.execute(
+            Product.__table__.update()
+            .where(Product.__table__.c.id == product["id"])
+            .values(version=2)
+        )
+        db.session.commit()
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": '"v1"'}
+        )
+        self.assertEqual(response.status_code, 412)  # HTTP_412_PRECONDITION_FAILED
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.headers["ETag"], '"v2"')
+
+    def test_update_product_if_match_name_index(self):
+        """Test that conditional writes keep the name suggestions current"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/suggest?prefix={product['name']}")
+        self.assertEqual(response.get_json(), [product["name"]])
+        old_name, product["name"] = product["name"], "Renamed"
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": '"v1"'}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=ren")
+        self.assertEqual(response.get_json(), ["Renamed"])
+        response = self.app.get(f"{BASE_URL}/suggest?prefix={old_name}")
+        self.assertNotIn(old_name, response.get_json())
+        response = self.app.delete(f"{BASE_URL}/{product['id']}", headers={"If-Match": '"v2"'})
+        self.assertEqual(response.status_code, 204)  # HTTP_204_NO_CONTENT
+        response = self.app.get(f"{BASE_URL}/suggest?prefix=ren")
+        self.assertEqual(response.get_json(), [])
+
+    def test_update_product_if_match_single_statement(self):
+        """Test that conditional writes run one statement and no SELECT"""
+        product = self._create_products(1)[0]
+        statements = []
+
+        def capture(_conn, _cursor, statement, *_args):
+            statements.append(statement.split()[0])
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", capture)
+        response = self.app.put(
+            f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": '"v1"'}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        response = self.app.delete(f"{BASE_URL}/{product['id']}", headers={"If-Match": '"v2"'})
+        self.assertEqual(response.status_code, 204)  # HTTP_204_NO_CONTENT
+        self.assertEqual(statements, ["UPDATE", "DELETE"])
+
+    def test_delete_product_changed_concurrently(self):
+        """Test that a delete racing an update is a 412, not a 500"""
+        product = self._create_products(1)[0]
+        find = Product.find
+
+        def find_then_update(product_id):
+            found = find(product_id)
+            db.session.execute(
+                Product.__table__.update()
+                .where(Product.__table__.c.id == product_id)
+                .values(version=Product.__table__.c.version + 1)
+            )
+            return found
+
+        with patch.object(Product, "find", side_effect=find_then_update):
+            response = self.app.delete(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.status_code, 412)  # HTTP_412_PRECONDITION_FAILED
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+
+    def test_delete_product_if_match(self):
+        """Test deleting a product only at the version the client has"""
+        product = self._create_products(1)[0]
+        response = self.app.delete(f"{BASE_URL}/{product['id']}", headers={"If-Match": '"v2"'})
+        self.assertEqual(response.status_code, 412)  # HTTP_412_PRECONDITION_FAILED
+        response = self.app.delete(f"{BASE_URL}/{product['id']}", headers={"If-Match": '"v1"'})
+        self.assertEqual(response.status_code, 204)  # HTTP_204_NO_CONTENT
+        response = self.app.delete(f"{BASE_URL}/{product['id']}", headers={"If-Match": '"v1"'})
+        self.assertEqual(response.status_code, 404)  # HTTP_404_NOT_FOUND
+
+    def test_deleted_product_etag_not_reused(self):
+        """Test that a new product does not match the ETag of a deleted one"""
+        product = self._create_products(1)[0]
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        etag = response.headers["ETag"]
+        self.app.delete(f"{BASE_URL}/{product['id']}")
+        created = self._create_products(1)[0]
+        self.assertNotEqual(created["id"], product["id"])
+        response = self.app.get(f"{BASE_URL}/{product['id']}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 404)  # HTTP_404_NOT_FOUND
+
+    def test_bulk_update_bumps_version(self):
+        """Test that bulk updates change the version ETag"""
+        product = self._create_products(1)[0]
+        response = self.app.patch(
+            f"{BASE_URL}/bulk", json={"ids": [product["id"]], "set": {"available": False}}
+        )
+        self.assertEqual(response.status_code, 200)  # HTTP_200_OK
+        response = self.app.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.headers["ETag"], '"v2"')
+
+
 if __name__ == "__main__":
     unittest.main()
 
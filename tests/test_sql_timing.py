@@ -0,0 +1,108 @@
+"""
+Test cases for the SQL statement timing
+"""
+import re
+from unittest import TestCase
+from service import app
+from service.models import db, product_cache
+from service.common.sql_timing import redact_parameters, statement_shape
+from tests.factories import ProductFactory
+
+SERVER_TIMING = re.compile(r'^db;dur=\d+\.\d\d;desc="(\d+) queries"$')
+
+
+class TestStatementShape(TestCase):
+    """Test the statement helpers"""
+
+    def test_statement_shape(self):
+        """It should collapse literals, IN lists and whitespace"""
+        self.assertEqual(
+            statement_shape("SELECT *\n  FROM product WHERE id IN (?, ?, ?) AND name = 'Hat'"),
+            "SELECT * FROM product WHERE id IN (?) AND name = ?",
+        )
+        self.assertEqual(
+            statement_shape("SELECT anon_1 FROM product LIMIT 10"),
+            "SELECT anon_1 FROM product LIMIT ?",
+        )
+
+    def test_redact_parameters(self):
+        """It should describe parameters without their values"""
+        self.assertEqual(redact_parameters(("secret", 1)), "[2 parameters redacted]")
+        self.assertEqual(redact_parameters({"name": "secret"}), "[1 parameters redacted]")
+        self.assertEqual(redact_parameters([("a",), ("b",)]), "[2 parameter sets redacted]")
+        self.assertEqual(redact_parameters(None), "[0 parameters redacted]")
+
+
+class TestSQLTiming(TestCase):
+    """Test the statement counts, slow query log and N+1 warnings"""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+        app.config["TESTING"] = True
+        self.client = app.test_client()
+        self.config = {
+            key: app.config[key] for key in ("SQL_SLOW_QUERY_MS", "SQL_REPEAT_THRESHOLD")
+        }
+        db.drop_all()
+        db.create_all()
+        product_cache.clear()
+
+    def tearDown(self):
+        app.config.update(self.config)
+        db.session.remove()
+        db.drop_all()
+
+    def test_server_timing(self):
+        """It should send the statement count and time in Server-Timing"""
+        product = self.client.post("/products", json=ProductFactory().serialize()).get_json()
+        product_cache.clear()
+        response = self.client.get(f"/products/{product['id']}")
+        match = SERVER_TIMING.match(response.headers["Server-Timing"])
+        self.assertIsNotNone(match)
+        self.assertEqual(int(match.group(1)), 1)
+
+        # a cached read does not touch the database
+        response = self.client.get(f"/products/{product['id']}")
+        self.assertEqual(SERVER_TIMING.match(response.headers["Server-Timing"]).group(1), "0")
+
+    def test_streamed_listing(self):
+        """It should not send Server-Timing before a streamed listing has run"""
+        self.client.post("/products", json=ProductFactory().serialize())
+        app.config["SQL_REPEAT_THRESHOLD"] = 1
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            response = self.client.get("/products?stream=true")
+            self.assertNotIn("Server-Timing", response.headers)
+            self.assertEqual(len(response.get_json()), 1)
+            response.close()
+        self.assertTrue(
+            any("Possible N+1 query: GET /products ran 1 times: SELECT" in line
+                for line in logs.output)
+        )
+
+    def test_slow_query_redacted(self):
+        """It should log slow statements without their values"""
+        app.config["SQL_SLOW_QUERY_MS"] = 0
+        product = ProductFactory(name="TopSecretName").serialize()
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            self.client.post("/products", json=product)
+        slow = [line for line in logs.output if "Slow query" in line]
+        self.assertTrue(any("INSERT INTO product" in line for line in slow))
+        self.assertFalse(any("TopSecretName" in line for line in logs.output))
+        self.assertTrue(any("parameters redacted" in line for line in slow))
+
+    def test_repeated_statement_warning(self):
+        """It should warn when a request repeats one statement too often"""
+        app.config["SQL_REPEAT_THRESHOLD"] = 3
+        app.config["BULK_CHUNK_SIZE"], chunk_size = 1, app.config["BULK_CHUNK_SIZE"]
+        items = [ProductFactory().serialize() for _ in range(3)]
+        try:
+            with self.assertLogs("flask.app", level="WARNING") as logs:
+                self.client.post("/products/bulk", json=items)
+        finally:
+            app.config["BULK_CHUNK_SIZE"] = chunk_size
+        self.assertTrue(
+            any("Possible N+1 query: POST /products/bulk ran 3 times" in line
+                for line in logs.output)
+        )
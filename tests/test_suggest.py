@@ -0,0 +1,43 @@
+"""
+Test cases for the prefix index
+"""
+from unittest import TestCase
+from service.common.suggest import PrefixIndex
+
+
+class TestPrefixIndex(TestCase):
+    """Test the prefix index"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.index = PrefixIndex(max_age=60, timer=lambda: self.now)
+        self.index.rebuild(["banana", "Apple", "apricot", "Avocado", "apple"])
+
+    def test_suggest(self):
+        """It should return names by prefix regardless of case"""
+        self.assertEqual(self.index.suggest("ap"), ["Apple", "apple", "apricot"])
+        self.assertEqual(self.index.suggest("A", limit=2), ["Apple", "apple"])
+        self.assertEqual(self.index.suggest("b"), ["banana"])
+        self.assertEqual(self.index.suggest("c"), [])
+        self.assertEqual(self.index.suggest("zzz"), [])
+
+    def test_add_and_remove(self):
+        """It should count names shared by several items"""
+        self.index.add("Banana")
+        self.index.add("banana")
+        self.index.remove("banana")
+        self.assertEqual(self.index.suggest("ban"), ["Banana", "banana"])
+        self.index.remove("banana")
+        self.index.remove("missing")
+        self.assertEqual(self.index.suggest("ban"), ["Banana"])
+        self.assertEqual(len(self.index), 5)
+
+    def test_staleness(self):
+        """It should become stale after max_age or when invalidated"""
+        self.assertFalse(self.index.is_stale())
+        self.now = 60
+        self.assertTrue(self.index.is_stale())
+        self.index.rebuild([])
+        self.assertFalse(self.index.is_stale())
+        self.index.invalidate()
+        self.assertTrue(self.index.is_stale())